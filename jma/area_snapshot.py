@@ -0,0 +1,273 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import argparse
+
+# areas.json の階層（上位から順に）
+AREA_LEVELS = ("centers", "offices", "class10s", "class15s", "class20s")
+
+# スナップショットの識別子と形式のバージョン
+SNAPSHOT_MAGIC = b"JMAAREA\0"
+SNAPSHOT_VERSION = 2
+
+# ヘッダー: 識別子, バージョン, 元ファイルのサイズ・更新時刻・SHA-256, 文字列数, 地域数
+HEADER = struct.Struct("<8sIQQ32sII")
+
+# 階層ごとの (先頭の地域番号, 地域数)
+LEVEL_ENTRY = struct.Struct("<II")
+
+# 地域1件: 階層, コード, 名前, 英語名, かな, 気象台名（文字列番号）, 親の地域番号
+NODE = struct.Struct("<B3xIIIIIi")
+
+# 値がないことを表す文字列番号
+NO_STRING = 0xFFFFFFFF
+
+
+def default_snapshot_path(json_path):
+    """areas.json に対応するスナップショットのパス"""
+    return os.path.splitext(json_path)[0] + ".snapshot"
+
+
+def _sha256(path):
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def build_snapshot(json_path, snapshot_path=None):
+    """areas.json をメモリマップで読めるバイナリのスナップショットに変換
+
+    文字列は重複を除いて1つの表にまとめ、地域は階層順の固定長レコードの配列、
+    親は地域番号で持つ。作成したファイルのパスを返す。
+    """
+    snapshot_path = snapshot_path or default_snapshot_path(json_path)
+    stat = os.stat(json_path)
+    with open(json_path, "r", encoding="utf-8") as file:
+        area_data = json.load(file)
+
+    strings = []
+    string_ids = {}
+
+    def intern(value):
+        if value is None:
+            return NO_STRING
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    # 地域番号は階層順に振る
+    nodes = []
+    node_ids = {}
+    levels = []
+    for level_index, level in enumerate(AREA_LEVELS):
+        areas = area_data.get(level, {})
+        levels.append((len(nodes), len(areas)))
+        for code, area in areas.items():
+            node_ids[(level_index, code)] = len(nodes)
+            nodes.append((level_index, code, area))
+
+    records = []
+    for level_index, code, area in nodes:
+        parent = -1
+        if level_index and area.get("parent"):
+            parent = node_ids.get((level_index - 1, area["parent"]), -1)
+        records.append(NODE.pack(
+            level_index,
+            intern(code),
+            intern(area["name"]),
+            intern(area.get("enName")),
+            intern(area.get("kana")),
+            intern(area.get("officeName")),
+            parent,
+        ))
+
+    blob = bytearray()
+    offsets = []
+    for value in strings:
+        offsets.append(len(blob))
+        blob.extend(value.encode("utf-8"))
+    offsets.append(len(blob))
+
+    # 書き込み途中のファイルを読まれないよう、一時ファイルから置き換える
+    temp_path = snapshot_path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, stat.st_size, stat.st_mtime_ns,
+            _sha256(json_path), len(strings), len(nodes),
+        ))
+        for first, count in levels:
+            file.write(LEVEL_ENTRY.pack(first, count))
+        file.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        file.write(b"".join(records))
+        file.write(blob)
+    os.replace(temp_path, snapshot_path)
+    return snapshot_path
+
+
+class AreaSnapshot:
+    """メモリマップしたスナップショットから地域を読み出す"""
+
+    def __init__(self, snapshot_path):
+        with open(snapshot_path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.source_size, self.source_mtime_ns, self.source_sha256,
+         string_count, self.node_count) = HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self._map.close()
+            raise ValueError(f"対応していないスナップショットです: {snapshot_path}")
+
+        self._levels_offset = HEADER.size
+        self._strings_offset = self._levels_offset + LEVEL_ENTRY.size * len(AREA_LEVELS)
+        self._nodes_offset = self._strings_offset + 4 * (string_count + 1)
+        self._blob_offset = self._nodes_offset + NODE.size * self.node_count
+
+    def close(self):
+        """メモリマップを閉じる"""
+        self._map.close()
+
+    def is_fresh(self, json_path):
+        """元の areas.json から作り直す必要がないか
+
+        サイズと更新時刻が同じならそのまま使い、更新時刻だけが違う場合は
+        内容のハッシュで判定する。
+        """
+        try:
+            stat = os.stat(json_path)
+        except OSError:
+            return True
+        if stat.st_size != self.source_size:
+            return False
+        if stat.st_mtime_ns == self.source_mtime_ns:
+            return True
+        return _sha256(json_path) == self.source_sha256
+
+    def string(self, string_id):
+        """文字列番号から文字列を取得"""
+        if string_id == NO_STRING:
+            return None
+        start, end = struct.unpack_from(
+            "<II", self._map, self._strings_offset + 4 * string_id
+        )
+        return self._map[self._blob_offset + start:self._blob_offset + end].decode("utf-8")
+
+    def level_nodes(self, level):
+        """指定階層の地域番号の範囲"""
+        first, count = LEVEL_ENTRY.unpack_from(
+            self._map, self._levels_offset + LEVEL_ENTRY.size * AREA_LEVELS.index(level)
+        )
+        return range(first, first + count)
+
+    def names(self, level):
+        """指定階層の コード→名前 の辞書"""
+        result = {}
+        for node_id in self.level_nodes(level):
+            _, code, name = NODE.unpack_from(
+                self._map, self._nodes_offset + NODE.size * node_id
+            )[:3]
+            result[self.string(code)] = self.string(name)
+        return result
+
+    def _strings(self):
+        """文字列表をまとめて読み出す"""
+        string_count = (self._nodes_offset - self._strings_offset) // 4 - 1
+        offsets = struct.unpack_from(f"<{string_count + 1}I", self._map, self._strings_offset)
+        blob = self._map[self._blob_offset:]
+        return [
+            blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(string_count)
+        ]
+
+    def _records(self):
+        """地域レコードをまとめて読み出す"""
+        return list(NODE.iter_unpack(
+            self._map[self._nodes_offset:self._blob_offset]
+        ))
+
+    def area_rows(self):
+        """DBの areas と area_ancestors の行を地域レコードから直接作る
+
+        辞書に戻さず、親の地域番号をたどって上位地域を求める。areas の行は
+        (階層, コード, 名前, 英語名, かな, 親の階層, 親のコード)、
+        area_ancestors の行は (階層, コード, 上位の階層, 上位のコード, 距離)。
+        """
+        strings = self._strings()
+        records = self._records()
+
+        area_rows = []
+        ancestor_rows = []
+        # 地域番号 → その地域の (階層, コード, 距離) のリスト（親は子より先に現れる）
+        chains = []
+        for level, code, name, en_name, kana, _, parent in records:
+            level_name = AREA_LEVELS[level]
+            code = strings[code]
+            if parent >= 0:
+                parent_level = AREA_LEVELS[records[parent][0]]
+                parent_code = strings[records[parent][1]]
+                chain = [(parent_level, parent_code, 1)]
+                chain.extend(
+                    (ancestor_level, ancestor_code, distance + 1)
+                    for ancestor_level, ancestor_code, distance in chains[parent]
+                )
+            else:
+                parent_level = parent_code = None
+                chain = []
+            chains.append(chain)
+            area_rows.append((
+                level_name, code, strings[name],
+                strings[en_name] if en_name != NO_STRING else None,
+                strings[kana] if kana != NO_STRING else None,
+                parent_level, parent_code,
+            ))
+            ancestor_rows.extend(
+                (level_name, code, ancestor_level, ancestor_code, distance)
+                for ancestor_level, ancestor_code, distance in chain
+            )
+        return area_rows, ancestor_rows
+
+
+def open_snapshot(json_path):
+    """新しいスナップショットがあれば開く（ない・古い場合はNone）"""
+    snapshot_path = default_snapshot_path(json_path)
+    try:
+        snapshot = AreaSnapshot(snapshot_path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if not snapshot.is_fresh(json_path):
+        snapshot.close()
+        return None
+    return snapshot
+
+
+def load_offices(json_path):
+    """予報区（offices）の コード→名前 の辞書を取得（スナップショット優先）"""
+    snapshot = open_snapshot(json_path)
+    if snapshot is not None:
+        try:
+            return snapshot.names("offices")
+        finally:
+            snapshot.close()
+
+    with open(json_path, "r", encoding="utf-8") as file:
+        area_data = json.load(file)
+    return {code: area["name"] for code, area in area_data["offices"].items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="areas.json のスナップショットを作成")
+    parser.add_argument(
+        "json_path",
+        nargs="?",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "areas.json"),
+        help="元の areas.json のパス",
+    )
+    parser.add_argument("-o", "--output", help="出力先（省略時は areas.snapshot）")
+    args = parser.parse_args()
+
+    path = build_snapshot(args.json_path, args.output)
+    print(f"スナップショットを作成しました: {path} ({os.path.getsize(path)} bytes)")
@@ -0,0 +1,278 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jma_fetcher
+
+# 記録したJSONの置き場所（データソース名/コード.json）
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
+# areas.json のパス
+AREA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "areas.json")
+
+JST = timezone(timedelta(hours=9))
+
+# 合成する予報の基準時刻（生成した日時によらず同じ内容にするため固定）
+SYNTHETIC_NOW = datetime(2024, 6, 3, 12, 0, tzinfo=JST)
+
+# 合成する予報で使う天気コードと天気
+SYNTHETIC_WEATHERS = (
+    ("100", "晴れ"),
+    ("101", "晴れ　時々　くもり"),
+    ("111", "晴れ　のち　くもり"),
+    ("200", "くもり"),
+    ("201", "くもり　時々　晴れ"),
+    ("202", "くもり　一時　雨"),
+    ("300", "雨"),
+    ("313", "雨　のち　くもり"),
+    ("400", "雪"),
+)
+
+
+def recording_path(directory, source, code):
+    """記録したJSONのパス"""
+    return os.path.join(directory, source, f"{code}.json")
+
+
+def record(directory=RECORDINGS_DIR, codes=None, fetcher=None):
+    """気象庁APIから全予報区の予報JSONを取得して記録（レート制限つき）"""
+    fetcher = fetcher or jma_fetcher.default_fetcher
+    if codes is None:
+        with open(AREA_FILE, "r", encoding="utf-8") as file:
+            codes = list(json.load(file)["offices"])
+    os.makedirs(os.path.join(directory, "forecast"), exist_ok=True)
+    for code in codes:
+        data, _ = fetcher.fetch("forecast", code)
+        with open(recording_path(directory, "forecast", code), "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False)
+    return len(codes)
+
+
+def synthesize(directory=RECORDINGS_DIR, seed=0, now=SYNTHETIC_NOW):
+    """気象庁APIと同じ形の予報JSONを全予報区分つくって記録（ネットワークなしで使う）
+
+    3日間予報（天気・降水確率・気温）と週間予報の2ブロックからなり、
+    同じ seed と now なら同じ内容になる。
+    """
+    rng = random.Random(seed)
+    report = now.replace(hour=11 if now.hour >= 11 else 5, minute=0, second=0, microsecond=0)
+    today = report.replace(hour=0)
+    with open(AREA_FILE, "r", encoding="utf-8") as file:
+        area_data = json.load(file)
+
+    def day(offset, hour=0):
+        return (today + timedelta(days=offset, hours=hour)).isoformat()
+
+    os.makedirs(os.path.join(directory, "forecast"), exist_ok=True)
+    for code, office in area_data["offices"].items():
+        class10s = [
+            {"name": area_data["class10s"][child]["name"], "code": child}
+            for child in office.get("children", []) if child in area_data["class10s"]
+        ] or [{"name": office["name"], "code": code}]
+        stations = [
+            {"name": f"{area['name']}観測点", "code": f"{int(code[:2]):02d}{index:03d}"}
+            for index, area in enumerate(class10s)
+        ]
+
+        def weather_series(days):
+            choices = [rng.choice(SYNTHETIC_WEATHERS) for _ in range(days)]
+            return [c for c, _ in choices], [w for _, w in choices]
+
+        short_areas = []
+        for area in class10s:
+            codes, weathers = weather_series(3)
+            short_areas.append({
+                "area": area, "weatherCodes": codes, "weathers": weathers,
+                "winds": ["北の風"] * 3, "waves": ["０．５メートル"] * 3,
+            })
+        base = rng.uniform(0, 25)
+        forecast = [
+            {
+                "publishingOffice": office.get("officeName", "気象庁"),
+                "reportDatetime": report.isoformat(),
+                "timeSeries": [
+                    {
+                        "timeDefines": [day(i) for i in range(3)],
+                        "areas": short_areas,
+                    },
+                    {
+                        "timeDefines": [day(i // 4, 6 * (i % 4)) for i in range(2, 10)],
+                        "areas": [
+                            {"area": area, "pops": [str(rng.randrange(0, 101, 10)) for _ in range(8)]}
+                            for area in class10s
+                        ],
+                    },
+                    {
+                        "timeDefines": [day(0, 9), day(1, 0), day(1, 9)],
+                        "areas": [
+                            {"area": station, "temps": [
+                                str(round(base + 8)), str(round(base)), str(round(base + 9)),
+                            ]}
+                            for station in stations
+                        ],
+                    },
+                ],
+            },
+            {
+                "publishingOffice": office.get("officeName", "気象庁"),
+                "reportDatetime": report.replace(hour=11).isoformat(),
+                "timeSeries": [
+                    {
+                        "timeDefines": [day(i) for i in range(1, 8)],
+                        "areas": [
+                            {
+                                "area": class10s[0],
+                                "weatherCodes": weather_series(7)[0],
+                                "pops": [""] + [str(rng.randrange(0, 101, 10)) for _ in range(6)],
+                                "reliabilities": ["", ""] + [rng.choice("ABC") for _ in range(5)],
+                            }
+                        ],
+                    },
+                    {
+                        "timeDefines": [day(i) for i in range(1, 8)],
+                        "areas": [
+                            {
+                                "area": stations[0],
+                                "tempsMin": [""] + [str(round(base + rng.uniform(-3, 3))) for _ in range(6)],
+                                "tempsMax": [""] + [str(round(base + 8 + rng.uniform(-3, 3))) for _ in range(6)],
+                            }
+                        ],
+                    },
+                ],
+            },
+        ]
+        with open(recording_path(directory, "forecast", code), "w", encoding="utf-8") as file:
+            json.dump(forecast, file, ensure_ascii=False)
+    return len(area_data["offices"])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """記録したJSONを気象庁APIと同じURLで返す（ETagつき）"""
+
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文を別々に送るため、Nagleアルゴリズムによる遅延を避ける
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            self._send(503, b"", {"Retry-After": "0"})
+            return
+
+        body = server.lookup(self.path.split("?")[0])
+        if body is None:
+            self._send(404, b"")
+            return
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self._send(304, b"", {"ETag": etag})
+            return
+        self._send(200, body, {"ETag": etag, "Content-Type": "application/json"})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """記録したJSONを返すスタブサーバー（応答は起動時にメモリへ読み込む）"""
+
+    daemon_threads = True
+
+    def __init__(self, address, directory=RECORDINGS_DIR, latency=0.0, error_rate=0.0):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._bodies = {}
+        for adapter in jma_fetcher.SOURCES.values():
+            source_dir = os.path.join(directory, adapter.name)
+            if not os.path.isdir(source_dir):
+                continue
+            for name in os.listdir(source_dir):
+                if name.endswith(".json"):
+                    with open(os.path.join(source_dir, name), "rb") as file:
+                        self._bodies[adapter.path.format(name[:-5])] = file.read()
+
+    @property
+    def base_url(self):
+        """このサーバーのURL（JMA_BASE_URL に指定する）"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def fingerprint(self):
+        """記録の内容のハッシュ（ベースラインと同じ記録で比べているかの確認用）"""
+        digest = hashlib.sha256()
+        for path in sorted(self._bodies):
+            digest.update(path.encode("utf-8"))
+            digest.update(hashlib.sha256(self._bodies[path]).digest())
+        return digest.hexdigest()
+
+    @property
+    def recorded_codes(self):
+        """予報を記録済みの予報区コード"""
+        prefix, suffix = jma_fetcher.SOURCES["forecast"].path.split("{}")
+        return sorted(
+            path[len(prefix):-len(suffix)] for path in self._bodies
+            if path.startswith(prefix) and path.endswith(suffix)
+        )
+
+    def lookup(self, path):
+        """パスに対応する記録済みの応答（なければNone）"""
+        return self._bodies.get(path)
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+
+def start_stub_server(directory=RECORDINGS_DIR, host="127.0.0.1", port=0, **options):
+    """スタブサーバーを別スレッドで開始（記録がなければ合成する）"""
+    if not os.path.isdir(os.path.join(directory, "forecast")):
+        synthesize(directory)
+    server = StubServer((host, port), directory, **options)
+    threading.Thread(target=server.serve_forever, name="jma-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="記録した気象庁APIの応答を返すスタブサーバー")
+    parser.add_argument("--port", type=int, default=8000, help="待ち受けるポート")
+    parser.add_argument("--dir", default=RECORDINGS_DIR, help="記録したJSONの置き場所")
+    parser.add_argument("--latency", type=float, default=0.0, help="応答ごとに加える遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503を返す割合")
+    parser.add_argument("--record", action="store_true", help="気象庁APIから予報を記録して終了")
+    parser.add_argument("--synthesize", action="store_true", help="予報を合成して記録して終了")
+    args = parser.parse_args()
+
+    if args.record:
+        print(f"{record(args.dir)}件の予報を記録しました: {args.dir}")
+    elif args.synthesize:
+        print(f"{synthesize(args.dir)}件の予報を合成しました: {args.dir}")
+    else:
+        server = start_stub_server(
+            args.dir, port=args.port, latency=args.latency, error_rate=args.error_rate
+        )
+        print(f"スタブサーバーを起動しました: {server.base_url}（{len(server.recorded_codes)}予報区）")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -1,12 +1,14 @@
 import flet as ft
-import requests
-import json
+import os
 
-# 気象庁APIのエンドポイント
-FORECAST_URL = "https://www.jma.go.jp/bosai/forecast/data/forecast/{}.json"
+import area_snapshot
+import jma_fetcher
 
-# ローカルJSONファイルのパス
-LOCAL_AREA_FILE = "/Users/ema/DSPE/DSPG2/jma/areas.json"
+# ローカルJSONファイルのパス（環境変数 JMA_AREA_FILE で変更可能）
+LOCAL_AREA_FILE = os.environ.get(
+    "JMA_AREA_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "areas.json"),
+)
 
 # 天気と対応するアイコンと色
 WEATHER_ICONS = {
@@ -19,6 +21,11 @@ WEATHER_ICONS = {
     "曇り時々雨": (ft.icons.CLOUD_QUEUE, ft.colors.LIGHT_BLUE),
 }
 
+def get_forecast_json(region_code):
+    """予報JSONを取得（レート制限・再試行・条件付きGETは共有の取得処理で行う）"""
+    forecast_data, _ = jma_fetcher.default_fetcher.fetch("forecast", region_code)
+    return forecast_data
+
 def main(page: ft.Page):
     page.title = "天気予報アプリ"
     page.scroll = ft.ScrollMode.AUTO
@@ -59,12 +66,9 @@ def main(page: ft.Page):
     forecast_result = ft.Column(spacing=10)
 
     def fetch_regions_from_local():
-        """ローカルJSONファイルから地域リストを取得"""
+        """ローカルJSONファイルから地域リストを取得（スナップショットがあれば使用）"""
         try:
-            with open(LOCAL_AREA_FILE, "r", encoding="utf-8") as file:
-                area_data = json.load(file)
-                regions = {area_code: area["name"] for area_code, area in area_data["offices"].items()}
-                return regions
+            return area_snapshot.load_offices(LOCAL_AREA_FILE)
         except Exception as ex:
             forecast_result.controls.clear()
             forecast_result.controls.append(ft.Text(f"地域リスト取得エラー(ローカル): {ex}", color=ft.colors.RED))
@@ -92,9 +96,7 @@ def main(page: ft.Page):
             return
 
         try:
-            response = requests.get(FORECAST_URL.format(region_code))
-            response.raise_for_status()
-            forecast_data = response.json()
+            forecast_data = get_forecast_json(region_code)
 
             # 天気情報を抽出して表示
             forecast_result.controls.clear()
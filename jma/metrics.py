@@ -0,0 +1,256 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# メトリクスを公開するアドレス（環境変数 JMA_METRICS_PORT=0 で無効）
+METRICS_HOST = os.environ.get("JMA_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("JMA_METRICS_PORT", "9464"))
+
+# 処理時間のヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _format_labels(labelnames, labels, extra=()):
+    """ラベルを Prometheus の {name="value",...} 形式にする"""
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    """数値を Prometheus の形式にする"""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _counter_name(name):
+    """カウンターの名前（サンプル名と揃えて末尾を _total にする）"""
+    return name if name.endswith("_total") else name + "_total"
+
+
+class Metric:
+    """メトリクスの共通部分（名前・説明・ラベル名）"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def samples(self):
+        """(名前の接尾辞, ラベル, 追加ラベル, 値) のリスト"""
+        return []
+
+    def render(self):
+        """Prometheus のテキスト形式で出力"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} "
+                f"{_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """増えるだけの件数（名前の末尾には _total が付く）"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(_counter_name(name), help, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        """件数を加算"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        """現在の件数"""
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            return [("", labels, (), value) for labels, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """増減する値"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        """値を加算"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        """値を減算"""
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        """値を設定"""
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self):
+        with self._lock:
+            return [("", labels, (), value) for labels, value in sorted(self._values.items())]
+
+
+class CallbackGauge(Metric):
+    """出力するときに関数を呼んで値を得るゲージ（普段は何もしない）"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, func):
+        super().__init__(name, help)
+        self.func = func
+
+    def samples(self):
+        return [("", (), (), self.func())]
+
+
+class CallbackCounter(Metric):
+    """出力するときに関数を呼んで件数を得るカウンター（名前の末尾には _total が付く）"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, func):
+        super().__init__(_counter_name(name), help)
+        self.func = func
+
+    def samples(self):
+        return [("", (), (), self.func())]
+
+
+class Histogram(Metric):
+    """値の分布（区切りごとの件数と合計）"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # ラベル → [区切りごとの件数..., 上限なしの件数, 合計]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        """値を記録"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """with 文の中の処理時間を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        samples = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", labels, (("le", _format_value(float(bound))),), cumulative))
+            samples.append(("_sum", labels, (), counts[-1]))
+            samples.append(("_count", labels, (), cumulative))
+        return samples
+
+
+class Registry:
+    """メトリクスの一覧"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """メトリクスを登録（同じ名前は登録できない）"""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"メトリクス名が重複しています: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        """全メトリクスを Prometheus のテキスト形式で出力"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# プロセス全体で共有するメトリクスの一覧
+registry = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    """メトリクスを公開するHTTPサーバーを開始（開始済み、またはポートが0なら何もしない）
+
+    開始したサーバーのポート番号を返す（開始できなかった場合はNone）。
+    """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server.server_port
+        if not port or port < 0:
+            return None
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as ex:
+            print(f"メトリクスサーバー起動エラー: {ex}")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(
+            target=_server.serve_forever, name="metrics-server", daemon=True
+        ).start()
+        return _server.server_port
@@ -0,0 +1,438 @@
+import argparse
+import sqlite3
+from typing import NamedTuple
+
+import numpy as np
+
+# 分析対象の予報値の列
+VALUE_COLUMNS = ("temperature_min", "temperature_max", "rainfall_probability")
+
+# 「雨の可能性が高い」とみなす降水確率（%）
+HIGH_RAINFALL_PROBABILITY = 50
+
+# 保存された全予報（forecasts と forecast_archive）のうち、前回の集計以降の発表分
+HISTORY_SQL = """
+    SELECT h.region_code, h.area_code, h.forecast_date,
+           substr(h.report_datetime, 1, 19),
+           h.temperature_min, h.temperature_max, h.rainfall_probability
+    FROM (
+        SELECT region_code, area_code, forecast_date, report_datetime,
+               temperature_min, temperature_max, rainfall_probability
+        FROM forecasts
+        WHERE report_datetime IS NOT NULL
+        UNION ALL
+        SELECT region_code, area_code, forecast_date, report_datetime,
+               temperature_min, temperature_max, rainfall_probability
+        FROM forecast_archive
+    ) h
+    LEFT JOIN analytics_watermarks w ON w.region_code = h.region_code
+    WHERE h.report_datetime > COALESCE(w.last_report, '')
+"""
+
+
+class ForecastHistory(NamedTuple):
+    """予報履歴の列ごとの配列（1行 = ある発表での、ある地域・日付の予報）"""
+    region_codes: np.ndarray
+    area_codes: np.ndarray
+    forecast_date: np.ndarray
+    report_datetime: np.ndarray
+    temperature_min: np.ndarray
+    temperature_max: np.ndarray
+    rainfall_probability: np.ndarray
+
+
+class RegionStats(NamedTuple):
+    """地域ごとの集計結果（各要素は地域の並びに対応する配列）"""
+    region_codes: np.ndarray
+    temperature_min_volatility: np.ndarray
+    temperature_max_volatility: np.ndarray
+    rainfall_probability_volatility: np.ndarray
+    rainfall_probability_mean: np.ndarray
+    rainfall_probability_std: np.ndarray
+    high_rainfall_rate: np.ndarray
+
+
+class ForecastDrift(NamedTuple):
+    """対象日ごとの予報の変化（最初の発表から最新の発表まで）"""
+    region_codes: np.ndarray
+    area_codes: np.ndarray
+    forecast_date: np.ndarray
+    reports: np.ndarray
+    first_report: np.ndarray
+    last_report: np.ndarray
+    temperature_min_drift: np.ndarray
+    temperature_max_drift: np.ndarray
+    rainfall_probability_drift: np.ndarray
+
+
+def init_analytics_tables(conn):
+    """集計結果を保存するテーブルを作成"""
+    with conn:
+        # 地域ごとに集計済みの最新の発表時刻
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_watermarks (
+                region_code TEXT PRIMARY KEY,
+                last_report TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+        # 地域・指標ごとの件数・合計・二乗和（追加分を足し込んでいく）
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_stats (
+                region_code TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                total REAL NOT NULL,
+                total_sq REAL NOT NULL,
+                PRIMARY KEY (region_code, metric)
+            ) WITHOUT ROWID
+        """)
+        # 対象日ごとの最初と最新の予報値（欠測は直前の値で補う）
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_targets (
+                region_code TEXT NOT NULL,
+                area_code TEXT NOT NULL,
+                forecast_date TEXT NOT NULL,
+                reports INTEGER NOT NULL,
+                first_report TEXT NOT NULL,
+                last_report TEXT NOT NULL,
+                first_temperature_min REAL,
+                first_temperature_max REAL,
+                first_rainfall_probability REAL,
+                last_temperature_min REAL,
+                last_temperature_max REAL,
+                last_rainfall_probability REAL,
+                PRIMARY KEY (region_code, area_code, forecast_date)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_analytics_targets_date
+            ON analytics_targets (forecast_date)
+        """)
+
+
+def _float_column(values):
+    """NULLをNaNにした浮動小数点の配列"""
+    return np.array(values, dtype=np.float64)
+
+
+def load_history(conn):
+    """前回の集計以降の予報履歴を1回の問い合わせで列ごとの配列として読み込む"""
+    rows = conn.execute(HISTORY_SQL).fetchall()
+    if not rows:
+        return None
+    columns = list(zip(*rows))
+    return ForecastHistory(
+        region_codes=np.array(columns[0]),
+        area_codes=np.array(columns[1]),
+        forecast_date=np.array(columns[2], dtype="datetime64[D]"),
+        report_datetime=np.array(columns[3], dtype="datetime64[s]"),
+        temperature_min=_float_column(columns[4]),
+        temperature_max=_float_column(columns[5]),
+        rainfall_probability=_float_column(columns[6]),
+    )
+
+
+def _load_targets(conn, history):
+    """今回の履歴と同じ対象日以降の、集計済みの対象日ごとの状態を読み込む"""
+    since = str(history.forecast_date.min())
+    rows = conn.execute("""
+        SELECT region_code, area_code, forecast_date, reports,
+               substr(first_report, 1, 19), substr(last_report, 1, 19),
+               first_temperature_min, first_temperature_max, first_rainfall_probability,
+               last_temperature_min, last_temperature_max, last_rainfall_probability
+        FROM analytics_targets
+        WHERE forecast_date >= ?
+    """, (since,)).fetchall()
+    if not rows:
+        return None
+    columns = list(zip(*rows))
+    return {
+        "region_codes": np.array(columns[0]),
+        "area_codes": np.array(columns[1]),
+        "forecast_date": np.array(columns[2], dtype="datetime64[D]"),
+        "reports": np.array(columns[3], dtype=np.int64),
+        "first_report": np.array(columns[4], dtype="datetime64[s]"),
+        "report_datetime": np.array(columns[5], dtype="datetime64[s]"),
+        "first": {
+            name: _float_column(columns[6 + i]) for i, name in enumerate(VALUE_COLUMNS)
+        },
+        "last": {
+            name: _float_column(columns[9 + i]) for i, name in enumerate(VALUE_COLUMNS)
+        },
+    }
+
+
+def _fill_forward(values, group_start):
+    """各グループ内で、欠測を直前の値で補う（グループをまたがない）"""
+    index = np.arange(len(values))
+    index = np.where(~np.isnan(values) | group_start, index, 0)
+    return values[np.maximum.accumulate(index)]
+
+
+def _fill_backward(values, group_end):
+    """各グループ内で、欠測を直後の値で補う（グループをまたがない）"""
+    return _fill_forward(values[::-1], group_end[::-1])[::-1]
+
+
+def _sums(groups, values, size):
+    """グループごとの件数・合計・二乗和（NaNは除く）"""
+    valid = ~np.isnan(values)
+    groups, values = groups[valid], values[valid]
+    return (
+        np.bincount(groups, minlength=size),
+        np.bincount(groups, weights=values, minlength=size),
+        np.bincount(groups, weights=values * values, minlength=size),
+    )
+
+
+def _to_report(values):
+    """datetime64 を保存時の発表時刻の形式（日本時間）に戻す"""
+    return np.char.add(np.datetime_as_string(values, unit="s"), "+09:00")
+
+
+def update_aggregates(conn):
+    """前回の集計以降の予報履歴を読み込み、集計結果に足し込む
+
+    予報の修正幅（同じ対象日の予報の、発表ごとの変化）と降水確率の件数・合計・
+    二乗和を地域ごとに加算し、対象日ごとの最初と最新の予報値を更新する。
+    計算はすべて配列演算で行う。戻り値は今回集計した行数。
+    """
+    init_analytics_tables(conn)
+    # 読み込みから書き込みまでの間に他の書き込みが入らないようにする
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        history = load_history(conn)
+        if history is None:
+            conn.rollback()
+            return 0
+        count = len(history.region_codes)
+        state = _load_targets(conn, history)
+
+        # 集計済みの状態を「最新の発表の行」として今回の履歴の前に並べる
+        is_state = np.zeros(count, dtype=bool)
+        region_codes = history.region_codes
+        area_codes = history.area_codes
+        forecast_date = history.forecast_date
+        report_datetime = history.report_datetime
+        values = {name: getattr(history, name) for name in VALUE_COLUMNS}
+        if state is not None:
+            is_state = np.concatenate([np.ones(len(state["reports"]), dtype=bool), is_state])
+            region_codes = np.concatenate([state["region_codes"], region_codes])
+            area_codes = np.concatenate([state["area_codes"], area_codes])
+            forecast_date = np.concatenate([state["forecast_date"], forecast_date])
+            report_datetime = np.concatenate([state["report_datetime"], report_datetime])
+            values = {
+                name: np.concatenate([state["last"][name], values[name]])
+                for name in VALUE_COLUMNS
+            }
+
+        # 地域・地点・対象日・発表時刻の順に並べ替え、対象日ごとのグループを作る
+        regions, region_index = np.unique(region_codes, return_inverse=True)
+        areas, area_index = np.unique(area_codes, return_inverse=True)
+        order = np.lexsort((~is_state, report_datetime, forecast_date, area_index, region_index))
+        region_index = region_index[order]
+        area_index = area_index[order]
+        forecast_date = forecast_date[order]
+        report_datetime = report_datetime[order]
+        is_state = is_state[order]
+        values = {name: column[order] for name, column in values.items()}
+
+        group_start = np.ones(len(order), dtype=bool)
+        group_start[1:] = (
+            (region_index[1:] != region_index[:-1])
+            | (area_index[1:] != area_index[:-1])
+            | (forecast_date[1:] != forecast_date[:-1])
+        )
+        group_end = np.roll(group_start, -1)
+        group_end[-1] = True
+        group = np.cumsum(group_start) - 1
+        starts = np.flatnonzero(group_start)
+        ends = np.flatnonzero(group_end)
+
+        # 発表ごとの修正幅: 直前の（欠測でない）予報値からの変化
+        stats = {}
+        size = len(regions)
+        last_values = {}
+        first_values = {}
+        for name, column in values.items():
+            filled = _fill_forward(column, group_start)
+            revision = np.full(len(column), np.nan)
+            revision[1:] = column[1:] - filled[:-1]
+            revision[group_start] = np.nan
+            stats[f"{name}_revision"] = _sums(region_index, revision, size)
+            last_values[name] = filled[ends]
+            first_values[name] = _fill_backward(column, group_end)[starts]
+
+        # 降水確率の分布（集計済みの状態の行は数えない）
+        rainfall = np.where(is_state, np.nan, values["rainfall_probability"])
+        stats["rainfall_probability"] = _sums(region_index, rainfall, size)
+        high = np.where(np.isnan(rainfall), np.nan, rainfall >= HIGH_RAINFALL_PROBABILITY)
+        stats["high_rainfall"] = _sums(region_index, high, size)
+
+        # 対象日ごとの報告数と最初の発表（集計済みの対象日は以前の値を引き継ぐ）
+        reports = np.bincount(group, weights=~is_state, minlength=len(starts)).astype(np.int64)
+        first_report = report_datetime[starts]
+        state_first = is_state[starts]
+        if state is not None and state_first.any():
+            state_order = np.flatnonzero(is_state[starts])
+            source = order[starts[state_order]]
+            reports[state_order] += state["reports"][source]
+            first_report[state_order] = state["first_report"][source]
+            for name in VALUE_COLUMNS:
+                previous = state["first"][name][source]
+                keep = ~np.isnan(previous)
+                first_values[name][state_order[keep]] = previous[keep]
+
+        conn.executemany("""
+            INSERT INTO analytics_stats (region_code, metric, count, total, total_sq)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (region_code, metric) DO UPDATE SET
+                count = count + excluded.count,
+                total = total + excluded.total,
+                total_sq = total_sq + excluded.total_sq
+        """, [
+            (region, metric, count_, total, total_sq)
+            for metric, sums in stats.items()
+            for region, count_, total, total_sq in zip(
+                regions.tolist(), sums[0].tolist(), sums[1].tolist(), sums[2].tolist()
+            )
+        ])
+
+        def nullable(column):
+            return [None if np.isnan(value) else value for value in column.tolist()]
+
+        conn.executemany("""
+            INSERT OR REPLACE INTO analytics_targets (
+                region_code, area_code, forecast_date, reports, first_report, last_report,
+                first_temperature_min, first_temperature_max, first_rainfall_probability,
+                last_temperature_min, last_temperature_max, last_rainfall_probability
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, zip(
+            regions[region_index[starts]].tolist(),
+            areas[area_index[starts]].tolist(),
+            np.datetime_as_string(forecast_date[starts], unit="D").tolist(),
+            reports.tolist(),
+            _to_report(first_report).tolist(),
+            _to_report(report_datetime[ends]).tolist(),
+            *(nullable(first_values[name]) for name in VALUE_COLUMNS),
+            *(nullable(last_values[name]) for name in VALUE_COLUMNS),
+        ))
+
+        # 次回はこの発表より後の分だけを読み込む
+        new_rows = ~is_state
+        reported = np.zeros(size, dtype=bool)
+        reported[region_index[new_rows]] = True
+        latest = np.zeros(size, dtype=np.int64)
+        np.maximum.at(latest, region_index[new_rows], report_datetime[new_rows].astype(np.int64))
+        latest = latest.astype("datetime64[s]")
+        conn.executemany("""
+            INSERT INTO analytics_watermarks (region_code, last_report)
+            VALUES (?, ?)
+            ON CONFLICT (region_code) DO UPDATE SET
+                last_report = MAX(last_report, excluded.last_report)
+        """, zip(regions[reported].tolist(), _to_report(latest[reported]).tolist()))
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def region_statistics(conn):
+    """地域ごとの予報の修正幅の標準偏差（ばらつき）と降水確率の統計"""
+    init_analytics_tables(conn)
+    rows = conn.execute("""
+        SELECT region_code, metric, count, total, total_sq
+        FROM analytics_stats
+        ORDER BY region_code
+    """).fetchall()
+    if not rows:
+        empty = np.array([], dtype=np.float64)
+        return RegionStats(np.array([], dtype=str), *([empty] * 6))
+
+    columns = list(zip(*rows))
+    regions, region_index = np.unique(np.array(columns[0]), return_inverse=True)
+    metrics = np.array(columns[1])
+    count = np.array(columns[2], dtype=np.float64)
+    total = np.array(columns[3], dtype=np.float64)
+    total_sq = np.array(columns[4], dtype=np.float64)
+
+    def metric(name):
+        """指標ごとの (件数, 平均, 標準偏差) を地域の並びで返す"""
+        selected = metrics == name
+        n = np.zeros(len(regions))
+        s = np.zeros(len(regions))
+        sq = np.zeros(len(regions))
+        n[region_index[selected]] = count[selected]
+        s[region_index[selected]] = total[selected]
+        sq[region_index[selected]] = total_sq[selected]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = s / n
+            std = np.sqrt(np.maximum(sq / n - mean * mean, 0))
+        return n, mean, std
+
+    _, rainfall_mean, rainfall_std = metric("rainfall_probability")
+    return RegionStats(
+        region_codes=regions,
+        temperature_min_volatility=metric("temperature_min_revision")[2],
+        temperature_max_volatility=metric("temperature_max_revision")[2],
+        rainfall_probability_volatility=metric("rainfall_probability_revision")[2],
+        rainfall_probability_mean=rainfall_mean,
+        rainfall_probability_std=rainfall_std,
+        high_rainfall_rate=metric("high_rainfall")[1],
+    )
+
+
+def forecast_drift(conn, region_code=None):
+    """対象日ごとに、最初の発表から最新の発表までに予報がどれだけ変わったか"""
+    init_analytics_tables(conn)
+    sql = """
+        SELECT region_code, area_code, forecast_date, reports,
+               substr(first_report, 1, 19), substr(last_report, 1, 19),
+               last_temperature_min - first_temperature_min,
+               last_temperature_max - first_temperature_max,
+               last_rainfall_probability - first_rainfall_probability
+        FROM analytics_targets
+    """
+    params = ()
+    if region_code is not None:
+        sql += " WHERE region_code = ?"
+        params = (region_code,)
+    rows = conn.execute(sql + " ORDER BY region_code, area_code, forecast_date", params).fetchall()
+    columns = list(zip(*rows)) if rows else [()] * 9
+    return ForecastDrift(
+        region_codes=np.array(columns[0], dtype=str),
+        area_codes=np.array(columns[1], dtype=str),
+        forecast_date=np.array(columns[2], dtype="datetime64[D]"),
+        reports=np.array(columns[3], dtype=np.int64),
+        first_report=np.array(columns[4], dtype="datetime64[s]"),
+        last_report=np.array(columns[5], dtype="datetime64[s]"),
+        temperature_min_drift=_float_column(columns[6]),
+        temperature_max_drift=_float_column(columns[7]),
+        rainfall_probability_drift=_float_column(columns[8]),
+    )
+
+
+def print_region_statistics(stats):
+    """地域ごとの統計を表形式で表示"""
+    print("地域     最低気温の修正幅  最高気温の修正幅  降水確率の修正幅  降水確率(平均±SD)  50%以上")
+    for row in zip(*stats):
+        region, tmin, tmax, pop_volatility, pop_mean, pop_std, high = row
+        print(
+            f"{region}  {tmin:14.2f}℃  {tmax:14.2f}℃  {pop_volatility:14.1f}%  "
+            f"{pop_mean:9.1f}±{pop_std:4.1f}%  {high * 100:6.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="保存された天気予報の履歴を分析")
+    parser.add_argument("db_name", nargs="?", default="weather_forecast.db", help="DBファイル")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_name)
+    try:
+        processed = update_aggregates(conn)
+        print(f"{processed}件の予報履歴を集計しました")
+        print_region_statistics(region_statistics(conn))
+    finally:
+        conn.close()
@@ -0,0 +1,283 @@
+import os
+
+# ベンチマーク中はメトリクスサーバーを起動しない
+os.environ.setdefault("JMA_METRICS_PORT", "0")
+
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from itertools import count
+
+import flet as ft
+from flet_core.connection import Connection
+from flet_core.protocol import (
+    CommandEncoder,
+    PageCommandResponsePayload,
+    PageCommandsBatchResponsePayload,
+)
+
+import main as app
+import jma_fetcher
+
+# スタブサーバーは開発用ツールのため、アプリには同梱せず jma/ から読み込む
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jma"))
+import jma_stub_server
+
+# 既定のベースライン（--save-baseline で更新）
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# p50・スループットがこの割合より悪くなったら性能低下とみなす
+REGRESSION_THRESHOLD = 0.2
+
+# p95 はばらつきが大きいため、この割合まで許容する
+TAIL_REGRESSION_THRESHOLD = 0.5
+
+# これより小さい差（ミリ秒）は誤差として扱う（p50, p95）
+REGRESSION_MIN_DELTA_MS = {"p50": 0.05, "p95": 1.0}
+
+# 計測回数がこれより少ない段階は比較しない
+MIN_COMPARED_SAMPLES = 20
+
+
+class FakeConnection(Connection):
+    """ブラウザの代わりにコマンドを受け取る接続（送信内容はJSONへの変換まで行う）"""
+
+    def __init__(self):
+        super().__init__()
+        self.page_url = "http://127.0.0.1/"
+        self.commands = 0
+        self._ids = count(1)
+
+    def send_command(self, session_id, command):
+        self.commands += 1
+        json.dumps(command, cls=CommandEncoder)
+        return PageCommandResponsePayload(result="", error="")
+
+    def send_commands(self, session_id, commands):
+        self.commands += len(commands)
+        json.dumps(commands, cls=CommandEncoder)
+        ids = [
+            f"_{next(self._ids)}"
+            for command in commands if command.name == "add"
+            for _ in command.commands
+        ]
+        return PageCommandsBatchResponsePayload(results=ids, error="")
+
+
+def percentile(values, p):
+    """最近傍順位法によるパーセンタイル"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """段階ごとの処理時間（ミリ秒）を記録"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def measure(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+        return result
+
+    def summary(self):
+        return {
+            stage: {
+                "n": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+            for stage, values in self.samples.items()
+        }
+
+
+def clear_forecasts():
+    """DBとキャッシュの予報を消す（毎回APIから取得し直す状態にする）"""
+    app.forecast_writer.flush()
+    conn = app.get_weather_db().get_connection()
+    with conn:
+        conn.execute("DELETE FROM forecasts")
+    app.forecast_cache.invalidate()
+
+
+def store(code, rows):
+    """保存を依頼し、DBへの書き込みが終わるまで待つ
+
+    依頼だけならキューに入れるだけで終わるため、地域ごとに書き込みまで
+    待って、DBへの書き込み時間を計測できるようにする。
+    """
+    app.forecast_writer.submit(code, rows)
+    app.forecast_writer.flush()
+
+
+def run_pipeline(recorder, scenario, view, fetcher, code):
+    """1地域分の 確認→取得→解析→保存→表示 を実行（main の _load_forecast と同じ順序）
+
+    表示は画面と同じ ForecastView.display で行う。
+    """
+    forecasts = recorder.measure(f"{scenario}.lookup", app.get_latest_forecast_from_db, code)
+    if not forecasts:
+        data, modified = recorder.measure(f"{scenario}.fetch", fetcher.fetch, "forecast", code)
+        rows = recorder.measure(f"{scenario}.parse", app.parse_forecast, data)
+        forecasts = app.primary_area_forecasts(rows)
+        if modified:
+            recorder.measure(f"{scenario}.store", store, code, rows)
+        else:
+            app.forecast_cache.set(code, forecasts, app.rows_report_datetime(rows))
+    recorder.measure(f"{scenario}.render", view.display, forecasts)
+
+
+def run_benchmark(rounds=5, recordings=jma_stub_server.RECORDINGS_DIR):
+    """全予報区の記録を使って各シナリオを実行し、結果を返す
+
+    full: 毎回 条件付きGETなしで取得し、解析・保存・表示まで行う
+    conditional: 304 が返る状態で取得し直す（保存はしない）
+    cached: キャッシュから表示だけ行う
+    """
+    server = jma_stub_server.start_stub_server(recordings)
+    codes = server.recorded_codes
+    loop = asyncio.new_event_loop()
+    connection = FakeConnection()
+    page = ft.Page(connection, "benchmark", loop)
+    view = app.ForecastView()
+    page.add(view.column)
+    recorder = Recorder()
+    throughput = {}
+
+    def unlimited_fetcher():
+        return jma_fetcher.JMAFetcher(
+            base_url=server.base_url,
+            rate_limiter=jma_fetcher.TokenBucket(rate=1e9, capacity=1e9),
+        )
+
+    def timed_rounds(scenario, prepare):
+        """prepare() で状態を整えてから全予報区を処理する、を rounds 回繰り返す"""
+        start = time.perf_counter()
+        for _ in range(rounds):
+            fetcher = prepare()
+            for code in codes:
+                run_pipeline(recorder, scenario, view, fetcher, code)
+        throughput[scenario] = len(codes) * rounds / (time.perf_counter() - start)
+
+    def cold():
+        # ETagを持たない新しい取得処理を使い、毎回200で全体を取得させる
+        clear_forecasts()
+        return unlimited_fetcher()
+
+    warm_fetcher = unlimited_fetcher()
+
+    def conditional():
+        clear_forecasts()
+        return warm_fetcher
+
+    try:
+        timed_rounds("full", cold)
+        for code in codes:
+            warm_fetcher.fetch("forecast", code)
+        timed_rounds("conditional", conditional)
+        timed_rounds("cached", lambda: warm_fetcher)
+    finally:
+        server.shutdown()
+        loop.close()
+
+    return {
+        "recordings": server.fingerprint,
+        "regions": len(codes),
+        "rounds": rounds,
+        "upstream_requests": server.requests,
+        "ui_commands": connection.commands,
+        "throughput": throughput,
+        "stages": recorder.summary(),
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD, min_delta=REGRESSION_MIN_DELTA_MS):
+    """ベースラインと比べて遅くなった段階・落ちたスループットの一覧"""
+    regressions = []
+    thresholds = {"p50": threshold, "p95": max(threshold, TAIL_REGRESSION_THRESHOLD)}
+    for stage, stats in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base is None or min(stats["n"], base["n"]) < MIN_COMPARED_SAMPLES:
+            continue
+        for key, limit in thresholds.items():
+            if stats[key] > base[key] * (1 + limit) and stats[key] - base[key] > min_delta[key]:
+                regressions.append(
+                    f"{stage} {key}: {base[key]:.3f}ms → {stats[key]:.3f}ms "
+                    f"(+{(stats[key] / base[key] - 1) * 100:.0f}%)"
+                )
+    for scenario, value in results["throughput"].items():
+        base = baseline.get("throughput", {}).get(scenario)
+        if base and value < base * (1 - threshold):
+            regressions.append(
+                f"{scenario} throughput: {base:.0f}/s → {value:.0f}/s "
+                f"(-{(1 - value / base) * 100:.0f}%)"
+            )
+    return regressions
+
+
+def print_results(results, baseline=None):
+    """結果を表形式で表示"""
+    print(f"{results['regions']}予報区 × {results['rounds']}回"
+          f"（上流へのリクエスト {results['upstream_requests']}件, UIコマンド {results['ui_commands']}件）")
+    print(f"{'段階':<22}{'n':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'基準p50':>10}")
+    for stage, stats in results["stages"].items():
+        base = (baseline or {}).get("stages", {}).get(stage)
+        base_text = f"{base['p50']:10.3f}" if base else f"{'-':>10}"
+        print(f"{stage:<22}{stats['n']:>6}{stats['p50']:>10.3f}{stats['p95']:>10.3f}"
+              f"{stats['p99']:>10.3f}{base_text}")
+    for scenario, value in results["throughput"].items():
+        print(f"スループット {scenario}: {value:.0f} 地域/秒")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="スタブサーバーの記録を使った予報処理のベンチマーク")
+    parser.add_argument("--rounds", type=int, default=5, help="全予報区を処理する回数")
+    parser.add_argument("--recordings", default=jma_stub_server.RECORDINGS_DIR,
+                        help="記録したJSONの置き場所（なければ合成する）")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="比較するベースライン")
+    parser.add_argument("--save-baseline", action="store_true", help="結果をベースラインとして保存")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="p50・スループットで性能低下とみなす割合")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    # 本番のDBを汚さないよう一時ファイルを使う
+    with tempfile.TemporaryDirectory() as directory:
+        app.DB_NAME = os.path.join(directory, "benchmark.db")
+        results = run_benchmark(args.rounds, args.recordings)
+        app.forecast_writer.stop()
+        app.get_weather_db().close()
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        print(f"ベースラインを保存しました: {args.baseline}")
+    elif baseline is not None:
+        if baseline.get("recordings") != results["recordings"]:
+            # 記録が違えば解析・保存する内容も違うため、比べても意味がない
+            print("ベースラインと記録の内容が異なるため比較しません（--save-baseline で作り直してください）")
+            sys.exit(2)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("性能低下:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("ベースラインからの性能低下はありません")
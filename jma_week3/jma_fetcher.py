@@ -0,0 +1,400 @@
+import os
+import random
+import threading
+import time
+
+import metrics
+
+# 気象庁サイトのURL（環境変数 JMA_BASE_URL でローカルのスタブサーバーなどに変更可能）
+JMA_BASE_URL = os.environ.get("JMA_BASE_URL", "https://www.jma.go.jp").rstrip("/")
+
+# APIリクエストのタイムアウト（秒）
+REQUEST_TIMEOUT = 10
+
+# 全データソース合計で許可する1秒あたりのリクエスト数（0以下なら制限なし）と、まとめて送れる数
+RATE_LIMIT = float(os.environ.get("JMA_RATE_LIMIT", "8"))
+RATE_BURST = int(os.environ.get("JMA_RATE_BURST", "16"))
+
+# 再試行の回数と待ち時間（秒、指数的に延ばす）
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# 再試行に使える予算: 最初のリクエスト1回ごとに RETRY_RATIO 回分たまり、最大 RETRY_BUDGET 回
+RETRY_RATIO = 0.1
+RETRY_BUDGET = 10
+
+# 連続して何回失敗したら気象庁APIへの接続を止めるか、止めてから再開を試すまでの秒数
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+# 再試行する HTTP ステータス
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# 同時に使い回す接続の数
+POOL_SIZE = 16
+
+UPSTREAM_REQUESTS = metrics.Counter(
+    "jma_upstream_requests", "気象庁APIへのリクエスト数（ステータス別）", ("source", "status")
+)
+UPSTREAM_SECONDS = metrics.Histogram(
+    "jma_upstream_request_seconds", "気象庁APIの応答時間（秒）", ("source",)
+)
+UPSTREAM_RETRIES = metrics.Counter("jma_upstream_retries", "気象庁APIへの再試行数", ("source",))
+DECODE_SECONDS = metrics.Histogram("jma_json_decode_seconds", "JSONの解析時間（秒）", ("source",))
+RATE_LIMIT_WAIT_SECONDS = metrics.Histogram(
+    "jma_rate_limit_wait_seconds", "レート制限で待った時間（秒）"
+)
+CIRCUIT_REJECTED = metrics.Counter(
+    "jma_circuit_rejected", "接続停止中のため送らなかったリクエスト数", ("source",)
+)
+
+
+class SourceAdapter:
+    """気象庁のJSONデータソース（URLの組み立てと応答の変換）"""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+    def url(self, base_url, code):
+        """指定コードのデータのURL"""
+        return base_url + self.path.format(code)
+
+    def parse(self, data):
+        """応答のJSONを利用する形に変換（既定ではそのまま）"""
+        return data
+
+
+# データソース名 → アダプター
+SOURCES = {}
+
+
+def register_source(adapter):
+    """データソースを登録（同じ名前なら置き換える）"""
+    SOURCES[adapter.name] = adapter
+    return adapter
+
+
+# 天気予報・天気概況・警報注意報
+register_source(SourceAdapter("forecast", "/bosai/forecast/data/forecast/{}.json"))
+register_source(SourceAdapter("overview", "/bosai/forecast/data/overview_forecast/{}.json"))
+register_source(SourceAdapter("warning", "/bosai/warning/data/warning/{}.json"))
+
+
+class TokenBucket:
+    """トークンバケットによるレート制限（スレッド間で共有。rate が0以下なら制限なし）"""
+
+    def __init__(self, rate=RATE_LIMIT, capacity=RATE_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """トークンを1つ取得（なければたまるまで待つ）。待った秒数を返す
+
+        deadline（time.monotonic() の時刻）までにたまらない場合は待たずに
+        DeadlineExceeded を送出する。
+        """
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise DeadlineExceeded("レート制限の待ち時間が期限を超えます")
+            time.sleep(delay)
+            waited += delay
+
+
+class RetryBudget:
+    """プロセス全体の再試行の予算
+
+    障害時に全リクエストが再試行して負荷が何倍にもなるのを防ぐため、
+    再試行は最初のリクエスト数の一定割合までに抑える。
+    """
+
+    def __init__(self, ratio=RETRY_RATIO, limit=RETRY_BUDGET):
+        self.ratio = ratio
+        self.limit = limit
+        self._balance = float(limit)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """最初のリクエストごとに予算を積み立てる"""
+        with self._lock:
+            self._balance = min(self.limit, self._balance + self.ratio)
+
+    def withdraw(self):
+        """再試行1回分の予算を使う（足りなければFalse）"""
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+class DeadlineExceeded(TimeoutError):
+    """呼び出し側の期限までに取得を終えられない"""
+
+
+class CircuitOpenError(Exception):
+    """気象庁APIへの接続を一時停止している"""
+
+    def __init__(self, remaining):
+        super().__init__(f"気象庁APIへの接続を一時停止しています（あと{remaining:.0f}秒）")
+        self.remaining = remaining
+
+
+class CircuitBreaker:
+    """失敗が続いている接続先を一定時間呼ばないようにするサーキットブレーカー
+
+    連続失敗が閾値に達すると開き、待機時間が過ぎたら1件だけ試しに通す。
+    その1件が成功すれば閉じ、失敗すれば再び待機する。
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """接続を止めているか"""
+        with self._lock:
+            return self._opened_at is not None
+
+    def check(self):
+        """呼び出してよいか確認（止めている間は CircuitOpenError）"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(max(remaining, 0))
+            self._trial = True
+
+    def record_success(self):
+        """成功を記録（接続を再開する）"""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_skipped(self):
+        """リクエストを送らずに終えたことを記録（試しの1件なら次の呼び出しに譲る）"""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        """失敗を記録（続いたら、または試しの1件が失敗したら接続を止める）"""
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+class RetryableStatus(Exception):
+    """再試行の対象となるHTTPステータスが返った"""
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}: {response.url}")
+        self.response = response
+
+
+def _retry_after(response):
+    """Retry-After ヘッダーの秒数（なければNone）"""
+    value = response.headers.get("Retry-After") if response is not None else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class JMAFetcher:
+    """全データソースで接続・レート制限・再試行の予算を共有してJSONを取得する
+
+    条件付きGETで前回から変わっていなければ前回のJSONを使い、接続エラーや
+    429/5xx の場合は指数バックオフで再試行する。再試行しても失敗が続く間は
+    サーキットブレーカーで呼び出しを止める。requests の読み込みと
+    セッションの作成は最初のリクエストまで遅らせる。
+    """
+
+    def __init__(self, base_url=JMA_BASE_URL, rate_limiter=None, retry_budget=None,
+                 circuit_breaker=None, pool_size=POOL_SIZE, timeout=REQUEST_TIMEOUT,
+                 max_retries=MAX_RETRIES):
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._session = None
+        # (データソース名, コード) → (ETag, Last-Modified, 前回のJSON)
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """接続プールつきのセッション（初回使用時に作成）"""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def _request(self, source, url, headers, deadline=None):
+        """レート制限と再試行つきでGETし、最後の応答を返す
+
+        deadline（time.monotonic() の時刻）があれば、各リクエストのタイムアウトを
+        残り時間までに縮め、期限を過ぎる再試行は行わない。
+        """
+        import requests
+
+        self.retry_budget.deposit()
+        attempt = 0
+        last_error = None
+        while True:
+            try:
+                RATE_LIMIT_WAIT_SECONDS.observe(self.rate_limiter.acquire(deadline))
+            except DeadlineExceeded:
+                # 再試行の前なら、期限切れではなく直前の失敗として扱う
+                if last_error is not None:
+                    raise last_error
+                raise
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    if last_error is not None:
+                        raise last_error
+                    raise DeadlineExceeded("取得の期限を過ぎました")
+            response = None
+            start = time.perf_counter()
+            try:
+                try:
+                    response = self.session.get(url, headers=headers, timeout=timeout)
+                finally:
+                    UPSTREAM_SECONDS.observe(time.perf_counter() - start, source)
+                UPSTREAM_REQUESTS.inc(source, response.status_code)
+                if response.status_code in RETRY_STATUSES:
+                    raise RetryableStatus(response)
+                return response
+            except (requests.ConnectionError, requests.Timeout, RetryableStatus) as ex:
+                if not isinstance(ex, RetryableStatus):
+                    UPSTREAM_REQUESTS.inc(source, type(ex).__name__)
+                if attempt >= self.max_retries or not self.retry_budget.withdraw():
+                    if isinstance(ex, RetryableStatus):
+                        ex.response.raise_for_status()
+                    raise
+                response = getattr(ex, "response", None)
+                last_error = ex
+
+            # サーバーの指定があればそれに従い、なければ揺らぎつきの指数バックオフ
+            delay = _retry_after(response)
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            delay = min(delay, BACKOFF_MAX)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                if isinstance(last_error, RetryableStatus):
+                    last_error.response.raise_for_status()
+                raise last_error
+            time.sleep(delay)
+            UPSTREAM_RETRIES.inc(source)
+            attempt += 1
+
+    def fetch(self, source, code, deadline=None):
+        """指定データソースのJSONを取得
+
+        戻り値は (変換後のデータ, 前回から更新があったかどうか) のタプル。
+        接続を止めている間はリクエストせずに CircuitOpenError を送出する。
+        deadline（time.monotonic() の時刻）までに終えられなければ
+        DeadlineExceeded などの例外を送出する。
+        """
+        adapter = SOURCES[source]
+        key = (source, code)
+        with self._lock:
+            cached = self._validators.get(key)
+
+        headers = {}
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        try:
+            self.circuit_breaker.check()
+        except CircuitOpenError:
+            CIRCUIT_REJECTED.inc(source)
+            raise
+        try:
+            response = self._request(
+                source, adapter.url(self.base_url, code), headers, deadline
+            )
+        except DeadlineExceeded:
+            # 気象庁APIの失敗ではない（リクエストを送る前に期限が来た）
+            self.circuit_breaker.record_skipped()
+            raise
+        except Exception:
+            self.circuit_breaker.record_failure()
+            raise
+        self.circuit_breaker.record_success()
+
+        if response.status_code == 304 and cached:
+            return cached[2], False
+
+        response.raise_for_status()
+        with DECODE_SECONDS.time(source):
+            data = adapter.parse(response.json())
+        with self._lock:
+            self._validators[key] = (
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                data,
+            )
+        return data, True
+
+
+class SourceClient:
+    """1つのデータソースだけを扱うクライアント（共有の取得処理を使う）"""
+
+    def __init__(self, source, fetcher=None):
+        self.source = source
+        self.fetcher = fetcher or default_fetcher
+
+    def fetch(self, code, deadline=None):
+        """JSONを取得。戻り値は (データ, 前回から更新があったかどうか)"""
+        return self.fetcher.fetch(self.source, code, deadline)
+
+
+# プロセス全体で共有する取得処理（レート制限と再試行の予算も共有される）
+default_fetcher = JMAFetcher()
+
+metrics.CallbackGauge(
+    "jma_circuit_open", "気象庁APIへの接続を止めているか（1なら停止中）",
+    lambda: int(default_fetcher.circuit_breaker.is_open),
+)
@@ -0,0 +1,324 @@
+import os
+
+# 負荷試験中はメトリクスサーバーを起動しない
+os.environ.setdefault("JMA_METRICS_PORT", "0")
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import flet as ft
+from flet_core.event import Event
+
+import main as app
+import jma_fetcher
+
+# スタブサーバーは開発用ツールのため、アプリには同梱せず jma/ から読み込む
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jma"))
+import jma_stub_server
+from benchmark import FakeConnection, Recorder, clear_forecasts, percentile
+
+# 試す同時セッション数
+DEFAULT_LEVELS = (1, 5, 10, 25, 50, 100, 200)
+
+# 1セッションで 予報の表示→お気に入り追加→削除 を繰り返す回数
+DEFAULT_ACTIONS = 3
+
+# 気象庁APIの応答にかかる時間の想定（秒、スタブサーバーで加える）
+DEFAULT_UPSTREAM_LATENCY = 0.05
+
+# p95 が最小の同時数のときのこの倍数を超えたら飽和とみなす
+SATURATION_LATENCY_FACTOR = 3.0
+
+# 同時数を増やしてもスループットがこの割合しか伸びなければ飽和とみなす
+SATURATION_MIN_GAIN = 0.1
+
+# 1操作の完了を待つ上限（秒）
+ACTION_TIMEOUT = 60
+
+
+class SessionPage(ft.Page):
+    """run_task で始めた処理を覚えておくページ（完了まで待って応答時間を測るため）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tasks = []
+
+    def run_task(self, handler, *args, **kwargs):
+        future = super().run_task(handler, *args, **kwargs)
+        self.tasks.append(future)
+        return future
+
+
+def find_controls(root, predicate):
+    """root 以下のコントロールから条件に合うものを探す"""
+    found = []
+    stack = [root]
+    while stack:
+        control = stack.pop()
+        if predicate(control):
+            found.append(control)
+        stack.extend(reversed(control._get_children()))
+    return found
+
+
+def find_button(page, text):
+    """表示文字列でボタンを探す"""
+    return find_controls(
+        page, lambda c: isinstance(c, ft.ElevatedButton) and c.text == text
+    )[0]
+
+
+class Session:
+    """1人分のブラウザ（main(page) を実行し、利用者と同じ順にボタンを押す）
+
+    Flet のWebサーバーと同じく、main と同期イベントハンドラは全セッション共有の
+    スレッドプールで、run_task の処理は共有のイベントループで実行する。
+    """
+
+    def __init__(self, index, executor, recorder, rng):
+        self.loop = asyncio.get_running_loop()
+        self.executor = executor
+        self.recorder = recorder
+        self.rng = rng
+        self.connection = FakeConnection()
+        self.page = SessionPage(self.connection, f"loadtest-{index}", self.loop, executor)
+        self.errors = 0
+
+    async def timed(self, action, func, *args):
+        """スレッドプールで func を実行し、run_task で始まった処理の完了までを記録"""
+        start = time.perf_counter()
+        started_tasks = len(self.page.tasks)
+        await self.loop.run_in_executor(self.executor, func, *args)
+        for future in self.page.tasks[started_tasks:]:
+            await asyncio.wait_for(asyncio.wrap_future(future), ACTION_TIMEOUT)
+        self.recorder.samples.setdefault(action, []).append(
+            (time.perf_counter() - start) * 1000
+        )
+
+    async def run(self, actions, think_time):
+        page = self.page
+        try:
+            await self.timed("open", app.main, page)
+            await self.timed("region_list", find_button(page, "地域リストを取得").on_click, None)
+
+            dropdown = find_controls(page, lambda c: isinstance(c, ft.Dropdown))[0]
+            fetch_button = find_button(page, "天気予報を取得")
+            add_button = find_button(page, "現在の地域をお気に入りに追加")
+            for _ in range(actions):
+                await asyncio.sleep(self.rng.uniform(0, think_time))
+                option = self.rng.choice(dropdown.options)
+                dropdown.value = option.key
+                await self.timed("forecast", fetch_button.on_click, None)
+                if self.shows_error():
+                    self.errors += 1
+
+                await asyncio.sleep(self.rng.uniform(0, think_time))
+                await self.timed("favorite_add", add_button.on_click, None)
+                tiles = find_controls(
+                    page,
+                    lambda c: isinstance(c, ft.ListTile) and c.title.value == option.text,
+                )
+                if not tiles:
+                    self.errors += 1
+                    continue
+                await self.timed("favorite_remove", tiles[0].trailing.on_click, None)
+        except Exception as ex:
+            self.errors += 1
+            print(f"セッションエラー({page.session_id}): {ex!r}")
+        finally:
+            # ブラウザを閉じたときと同じく close イベントを送る
+            await page.on_event_async(Event("page", "close", ""))
+
+    def shows_error(self):
+        """予報の欄にエラー表示（赤字）が出ているか"""
+        return bool(find_controls(
+            self.page,
+            lambda c: isinstance(c, ft.Text) and c.color == ft.colors.RED,
+        ))
+
+
+def reset_state(base_url, rate_limit):
+    """保存済みの予報とキャッシュを消し、ETagを持たない取得処理に差し替える
+
+    各同時数を同じ条件（最初は気象庁APIから取得する状態）で比べるため。
+    rate_limit が0なら上流へのレート制限なし。
+    """
+    clear_forecasts()
+    app.forecast_client.fetcher = jma_fetcher.JMAFetcher(
+        base_url=base_url, rate_limiter=jma_fetcher.TokenBucket(rate=rate_limit),
+    )
+
+
+async def run_level(sessions, executor, server, actions, think_time, ramp, seed):
+    """同時に sessions 個のセッションを動かし、操作ごとの応答時間とスループットを返す"""
+    recorder = Recorder()
+    rng = random.Random(seed)
+    requests_before = server.requests
+
+    async def start(session, delay):
+        await asyncio.sleep(delay)
+        await session.run(actions, think_time)
+
+    clients = [
+        Session(index, executor, recorder, random.Random(rng.random()))
+        for index in range(sessions)
+    ]
+    log = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        await asyncio.gather(*(
+            start(session, rng.uniform(0, ramp)) for session in clients
+        ))
+        app.forecast_writer.flush()
+    duration = time.perf_counter() - started
+
+    # main などが print するエラーもセッションのエラーとして数える
+    logged_errors = [line for line in log.getvalue().splitlines() if "エラー" in line]
+    samples = [value for values in recorder.samples.values() for value in values]
+    latency = recorder.summary()
+    latency["all"] = {"n": len(samples)}
+    for p in (50, 95, 99):
+        latency["all"][f"p{p}"] = percentile(samples, p) if samples else 0.0
+    return {
+        "sessions": sessions,
+        "duration": duration,
+        "actions": len(samples),
+        "errors": sum(session.errors for session in clients) + len(logged_errors),
+        "error_samples": logged_errors[:5],
+        "throughput": len(samples) / duration,
+        "upstream_requests": server.requests - requests_before,
+        "ui_commands": sum(session.connection.commands for session in clients),
+        "latency": latency,
+    }
+
+
+def find_saturation(levels, latency_factor=SATURATION_LATENCY_FACTOR,
+                    min_gain=SATURATION_MIN_GAIN):
+    """飽和した同時数の結果と理由を返す（飽和しなければ (None, None)）
+
+    エラーが出た、p95 が最小の同時数のときの latency_factor 倍を超えた、
+    スループットが前の同時数から min_gain の割合しか伸びなかった、のいずれか。
+    """
+    if not levels:
+        return None, None
+    base = levels[0]["latency"]["all"]["p95"]
+    previous = None
+    for level in levels:
+        if level["errors"]:
+            return level, f"エラー {level['errors']}件"
+        p95 = level["latency"]["all"]["p95"]
+        if previous is not None and p95 > base * latency_factor:
+            return level, f"p95 {base:.0f}ms → {p95:.0f}ms"
+        if previous is not None and level["throughput"] < previous["throughput"] * (1 + min_gain):
+            return level, (f"スループット {previous['throughput']:.1f}/s → "
+                           f"{level['throughput']:.1f}/s")
+        previous = level
+    return None, None
+
+
+async def run_load_test(levels, recordings, actions=DEFAULT_ACTIONS, think_time=0.0, ramp=0.0,
+                        upstream_latency=DEFAULT_UPSTREAM_LATENCY, rate_limit=jma_fetcher.RATE_LIMIT,
+                        workers=None, seed=0):
+    """同時数を段階的に増やしながら負荷をかけ、同時数ごとの結果を返す"""
+    server = jma_stub_server.start_stub_server(recordings, latency=upstream_latency)
+    # Flet のWebサーバーと同じく、全セッションで1つのスレッドプールを共有する
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="flet_loadtest")
+    results = []
+    try:
+        for sessions in levels:
+            reset_state(server.base_url, rate_limit)
+            result = await run_level(sessions, executor, server, actions, think_time, ramp, seed)
+            results.append(result)
+            print_level(result)
+    finally:
+        executor.shutdown(wait=False)
+        server.shutdown()
+    return results
+
+
+def print_header():
+    print(f"{'同時数':>6}{'操作':>7}{'エラー':>7}{'操作/秒':>9}{'p50(ms)':>10}{'p95(ms)':>10}"
+          f"{'p99(ms)':>10}{'予報p95':>10}{'起動p95':>10}{'上流':>6}")
+
+
+def print_level(result):
+    latency = result["latency"]
+    overall = latency["all"]
+
+    def p95(action):
+        return latency.get(action, {}).get("p95", 0.0)
+
+    print(f"{result['sessions']:>6}{result['actions']:>7}{result['errors']:>7}"
+          f"{result['throughput']:>9.1f}{overall['p50']:>10.1f}{overall['p95']:>10.1f}"
+          f"{overall['p99']:>10.1f}{p95('forecast'):>10.1f}{p95('open'):>10.1f}"
+          f"{result['upstream_requests']:>6}")
+    for line in result["error_samples"]:
+        print(f"    {line}")
+
+
+def print_saturation(results):
+    """飽和点と、同時接続数の上限の目安を表示"""
+    saturated, reason = find_saturation(results)
+    if saturated is None:
+        print(f"{results[-1]['sessions']}セッションまで飽和しませんでした")
+        return
+    healthy = [level for level in results if level["sessions"] < saturated["sessions"]]
+    print(f"飽和点: {saturated['sessions']}セッション（{reason}）")
+    if healthy:
+        limit = healthy[-1]["sessions"]
+        print(f"同時接続数の上限の目安: {limit}セッション"
+              f"（fly.toml の [services.concurrency] なら soft_limit = {max(1, limit * 4 // 5)}, "
+              f"hard_limit = {limit}）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="スタブサーバーを使って天気予報アプリに多数のセッションで負荷をかける"
+    )
+    parser.add_argument("--levels", default=",".join(map(str, DEFAULT_LEVELS)),
+                        help="試す同時セッション数（カンマ区切り）")
+    parser.add_argument("--actions", type=int, default=DEFAULT_ACTIONS,
+                        help="1セッションで 予報表示→お気に入り追加→削除 を繰り返す回数")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="操作の間に待つ最大秒数（0なら待たずに続ける）")
+    parser.add_argument("--ramp", type=float, default=0.0,
+                        help="セッションの開始をばらつかせる秒数（0なら一斉に開始）")
+    parser.add_argument("--upstream-latency", type=float, default=DEFAULT_UPSTREAM_LATENCY,
+                        help="スタブサーバーが応答ごとに加える遅延（秒）")
+    parser.add_argument("--rate-limit", type=float, default=jma_fetcher.RATE_LIMIT,
+                        help="気象庁APIへの1秒あたりのリクエスト数（0なら制限なし）")
+    parser.add_argument("--workers", type=int,
+                        help="イベントハンドラを実行するスレッド数（既定は Flet と同じ）")
+    parser.add_argument("--recordings", default=jma_stub_server.RECORDINGS_DIR,
+                        help="記録したJSONの置き場所（なければ合成する）")
+    parser.add_argument("--seed", type=int, default=0, help="操作を選ぶ乱数の種")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+    levels = sorted({int(level) for level in args.levels.split(",") if level.strip()})
+
+    # 本番のDBを汚さないよう一時ファイルを使う
+    with tempfile.TemporaryDirectory() as directory:
+        app.DB_NAME = os.path.join(directory, "loadtest.db")
+        print_header()
+        results = asyncio.run(run_load_test(
+            levels, args.recordings, args.actions, args.think_time, args.ramp,
+            args.upstream_latency, args.rate_limit, args.workers, args.seed,
+        ))
+        app.favorite_refresher.stop()
+        app.retention_scheduler.stop()
+        app.forecast_writer.stop()
+        app.get_weather_db().close()
+
+    print_saturation(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
@@ -1,18 +1,125 @@
+import time
+
+# プロセスの開始時刻（初回描画までの時間の計測用）
+PROCESS_START = time.perf_counter()
+
 import flet as ft
-import requests
 import json
 import sqlite3
-from datetime import datetime
+import argparse
+import asyncio
+import threading
+import random
+import os
+import queue
+import atexit
+import hashlib
+import unicodedata
+from functools import lru_cache
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+import area_snapshot
+import jma_fetcher
+import metrics
 
-# 気象庁APIのエンドポイント
-FORECAST_URL = "https://www.jma.go.jp/bosai/forecast/data/forecast/{}.json"
+# ローカルJSONファイルのパス（環境変数 JMA_AREA_FILE で変更可能）
+LOCAL_AREA_FILE = os.environ.get(
+    "JMA_AREA_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "areas.json"),
+)
 
-# ローカルJSONファイルのパス
-LOCAL_AREA_FILE = "/Users/ema/DSPE/DSPG2/jma/areas.json"
+# areas.json の階層（上位から順に）
+AREA_LEVELS = ("centers", "offices", "class10s", "class15s", "class20s")
+
+# 地域検索で返す最大件数
+REGION_SEARCH_LIMIT = 10
+
+# これより多くの接尾辞に一致する接頭辞は、検索結果をインデックス作成時に求めておく
+REGION_SEARCH_PRECOMPUTE_HITS = 128
 
 # データベース名
 DB_NAME = "weather_forecast.db"
 
+# SQLiteの接続設定（メモリマップサイズ, 接続ごとの文のキャッシュ数, ロック待ち秒数）
+DB_MMAP_SIZE = 64 * 1024 * 1024
+DB_CACHED_STATEMENTS = 256
+DB_BUSY_TIMEOUT = 5
+
+# forecasts に残す期間（日）。これより古い行はアーカイブへ移す
+FORECAST_RETENTION_DAYS = 1
+
+# 1回のトランザクションで移動・削除する行数
+RETENTION_CHUNK_SIZE = 500
+
+# 1回の整理で解放する最大ページ数
+RETENTION_VACUUM_PAGES = 1000
+
+# 古い予報を整理する間隔（秒）
+RETENTION_INTERVAL = 6 * 60 * 60
+
+# 画面からの予報取得の各段階の制限時間（秒）
+STAGE_TIMEOUTS = {
+    "cache": 0.5,
+    "fetch": 5.0,
+    "parse": 1.0,
+    "stale": 0.5,
+}
+
+# 画面からの予報取得で使うスレッド数（DB確認・解析用、気象庁APIの取得用、古い予報の読み出し用）
+STAGE_LOOKUP_WORKERS = 8
+STAGE_FETCH_WORKERS = 32
+STAGE_STALE_WORKERS = 4
+
+# 書き込み待ちの上限（件数）と、1回のトランザクションにまとめる最大件数
+WRITE_QUEUE_SIZE = 256
+WRITE_BATCH_SIZE = 64
+
+# 最初の書き込みが届いてから、同じトランザクションにまとめる相手を待つ秒数
+WRITE_BATCH_DELAY = 0.05
+
+# 処理時間・件数のメトリクス（JMA_METRICS_PORT のポートで Prometheus 形式で公開）
+STAGE_SECONDS = metrics.Histogram(
+    "forecast_stage_seconds", "予報の表示までの段階ごとの処理時間（秒）", ("stage",)
+)
+CACHE_REQUESTS = metrics.Counter(
+    "forecast_cache_requests", "利用者の要求ごとの予報キャッシュの参照結果（hit/miss）", ("result",)
+)
+DB_SECONDS = metrics.Histogram("db_query_seconds", "DBの問い合わせ・書き込み時間（秒）", ("query",))
+WRITE_BATCH_SIZE_HISTOGRAM = metrics.Histogram(
+    "forecast_write_batch_size", "1回のトランザクションでまとめた書き込み数",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+ACTIVE_SESSIONS = metrics.Gauge("app_active_sessions", "接続中のセッション数")
+ERRORS = metrics.Counter("app_errors", "処理ごとのエラー数", ("where",))
+
+# 一括取得時の最大同時リクエスト数
+PREFETCH_MAX_WORKERS = 16
+
+# 日本標準時
+JST = timezone(timedelta(hours=9))
+
+# 気象庁の天気予報の定時発表時刻（JST）
+JMA_PUBLISH_HOURS = (5, 11, 17)
+
+# メモリ上に保持する地域数の上限
+FORECAST_CACHE_SIZE = 128
+
+# 定時発表後もまだ前回の発表しか取れなかった場合に、取得し直すまでの秒数
+FORECAST_RETRY_TTL = 5 * 60
+
+# 定時発表からお気に入りの予報を取りに行くまでの待ち時間（秒）
+FAVORITE_REFRESH_DELAY = 5 * 60
+
+# お気に入り更新の開始時刻に加えるランダムな揺らぎの最大値（秒）
+FAVORITE_REFRESH_JITTER = 120
+
+# お気に入り更新時の最大同時リクエスト数
+FAVORITE_REFRESH_MAX_WORKERS = 4
+
 # 天気と対応するアイコンと色
 WEATHER_ICONS = {
     "晴れ": (ft.icons.SUNNY, ft.colors.ORANGE),
@@ -33,18 +140,226 @@ WEATHER_ICONS = {
     "所により雪": (ft.icons.AC_UNIT, ft.colors.CYAN),
 }
 
+# 気象庁の天気コードと天気名（週間予報は天気コードのみのため）
+WEATHER_CODES = {
+    "100": "晴れ",
+    "101": "晴れ時々曇り",
+    "102": "晴れ一時雨",
+    "103": "晴れ時々雨",
+    "104": "晴れ一時雪",
+    "105": "晴れ時々雪",
+    "106": "晴れ一時雨か雪",
+    "107": "晴れ時々雨か雪",
+    "108": "晴れ一時雨か雷雨",
+    "110": "晴れのち時々曇り",
+    "111": "晴れのち曇り",
+    "112": "晴れのち一時雨",
+    "113": "晴れのち時々雨",
+    "114": "晴れのち雨",
+    "115": "晴れのち一時雪",
+    "116": "晴れのち時々雪",
+    "117": "晴れのち雪",
+    "118": "晴れのち雨か雪",
+    "119": "晴れのち雨か雷雨",
+    "120": "晴れ朝夕一時雨",
+    "121": "晴れ朝の内一時雨",
+    "122": "晴れ夕方一時雨",
+    "123": "晴れ山沿い雷雨",
+    "124": "晴れ山沿い雪",
+    "125": "晴れ午後は雷雨",
+    "126": "晴れ昼頃から雨",
+    "127": "晴れ夕方から雨",
+    "128": "晴れ夜は雨",
+    "130": "朝の内霧のち晴れ",
+    "131": "晴れ明け方霧",
+    "132": "晴れ朝夕曇り",
+    "140": "晴れ時々雨で雷を伴う",
+    "160": "晴れ一時雪か雨",
+    "170": "晴れ時々雪か雨",
+    "181": "晴れのち雪か雨",
+    "200": "曇り",
+    "201": "曇り時々晴れ",
+    "202": "曇り一時雨",
+    "203": "曇り時々雨",
+    "204": "曇り一時雪",
+    "205": "曇り時々雪",
+    "206": "曇り一時雨か雪",
+    "207": "曇り時々雨か雪",
+    "208": "曇り一時雨か雷雨",
+    "209": "霧",
+    "210": "曇りのち時々晴れ",
+    "211": "曇りのち晴れ",
+    "212": "曇りのち一時雨",
+    "213": "曇りのち時々雨",
+    "214": "曇りのち雨",
+    "215": "曇りのち一時雪",
+    "216": "曇りのち時々雪",
+    "217": "曇りのち雪",
+    "218": "曇りのち雨か雪",
+    "219": "曇りのち雨か雷雨",
+    "220": "曇り朝夕一時雨",
+    "221": "曇り朝の内一時雨",
+    "222": "曇り夕方一時雨",
+    "223": "曇り日中時々晴れ",
+    "224": "曇り昼頃から雨",
+    "225": "曇り夕方から雨",
+    "226": "曇り夜は雨",
+    "228": "曇り昼頃から雪",
+    "229": "曇り夕方から雪",
+    "230": "曇り夜は雪",
+    "231": "曇り海上海岸は霧か霧雨",
+    "240": "曇り時々雨で雷を伴う",
+    "250": "曇り時々雪で雷を伴う",
+    "260": "曇り一時雪か雨",
+    "270": "曇り時々雪か雨",
+    "281": "曇りのち雪か雨",
+    "300": "雨",
+    "301": "雨時々晴れ",
+    "302": "雨時々止む",
+    "303": "雨時々雪",
+    "304": "雨か雪",
+    "306": "大雨",
+    "308": "雨で暴風を伴う",
+    "309": "雨一時雪",
+    "311": "雨のち晴れ",
+    "313": "雨のち曇り",
+    "314": "雨のち時々雪",
+    "315": "雨のち雪",
+    "316": "雨か雪のち晴れ",
+    "317": "雨か雪のち曇り",
+    "320": "朝の内雨のち晴れ",
+    "321": "朝の内雨のち曇り",
+    "322": "雨朝晩一時雪",
+    "323": "雨昼頃から晴れ",
+    "324": "雨夕方から晴れ",
+    "325": "雨夜は晴れ",
+    "326": "雨夕方から雪",
+    "327": "雨夜は雪",
+    "328": "雨一時強く降る",
+    "329": "雨一時みぞれ",
+    "340": "雪か雨",
+    "350": "雨で雷を伴う",
+    "361": "雪か雨のち晴れ",
+    "371": "雪か雨のち曇り",
+    "400": "雪",
+    "401": "雪時々晴れ",
+    "402": "雪時々止む",
+    "403": "雪時々雨",
+    "405": "大雪",
+    "406": "風雪強い",
+    "407": "暴風雪",
+    "409": "雪一時雨",
+    "411": "雪のち晴れ",
+    "413": "雪のち曇り",
+    "414": "雪のち雨",
+    "420": "朝の内雪のち晴れ",
+    "421": "朝の内雪のち曇り",
+    "422": "雪昼頃から雨",
+    "423": "雪夕方から雨",
+    "425": "雪一時強く降る",
+    "426": "雪のちみぞれ",
+    "427": "雪一時みぞれ",
+    "450": "雪で雷を伴う",
+}
+
+# 既存DBに追加する forecasts の列
+FORECAST_EXTRA_COLUMNS = [
+    ("area_code", "TEXT"),
+    ("area_name", "TEXT"),
+    ("weather_code", "TEXT"),
+    ("report_datetime", "TEXT"),
+    ("fetched_report_datetime", "TEXT"),
+]
+
+# 天気予報の一括UPSERT文（同じ発表・地域・日付の行は上書き）
+INSERT_FORECAST_SQL = """
+    INSERT INTO forecasts (
+        region_code, area_code, area_name, forecast_date, weather, weather_code,
+        temperature_min, temperature_max, rainfall_probability, report_datetime,
+        fetched_report_datetime
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (region_code, report_datetime, area_code, forecast_date)
+    DO UPDATE SET
+        area_name = excluded.area_name,
+        weather = excluded.weather,
+        weather_code = excluded.weather_code,
+        temperature_min = excluded.temperature_min,
+        temperature_max = excluded.temperature_max,
+        rainfall_probability = excluded.rainfall_probability,
+        fetched_report_datetime = excluded.fetched_report_datetime,
+        created_at = CURRENT_TIMESTAMP
+"""
+
+class ForecastRow(NamedTuple):
+    """地域・日付ごとに正規化した天気予報1件"""
+    area_code: str
+    area_name: str
+    forecast_date: str
+    weather: Optional[str]
+    weather_code: Optional[str]
+    temperature_min: Optional[float]
+    temperature_max: Optional[float]
+    rainfall_probability: Optional[int]
+    report_datetime: Optional[str]
+    fetched_report_datetime: Optional[str]
+
+class RegionMatch(NamedTuple):
+    """地域検索の結果1件（予報区に解決済み）"""
+    level: str
+    code: str
+    name: str
+    office_code: str
+    office_name: str
+
 class WeatherDB:
     def __init__(self, db_name=DB_NAME):
         self.db_name = db_name
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
         self.init_database()
 
     def get_connection(self):
-        """データベース接続を取得"""
-        return sqlite3.connect(self.db_name)
+        """データベース接続を取得
+
+        接続はスレッドごとに1つ作成して使い回す。WALモードにすることで
+        読み込みと書き込みが互いを待たないようにする。
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_name,
+                timeout=DB_BUSY_TIMEOUT,
+                cached_statements=DB_CACHED_STATEMENTS,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """このDBで開いたすべての接続を閉じる"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
 
     def init_database(self):
         """データベースの初期化"""
-        with self.get_connection() as conn:
+        conn = self.get_connection()
+
+        # 削除で空いた領域を少しずつ解放できるようにする（既存DBは一度だけVACUUM）
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+
+        with conn:
             cursor = conn.cursor()
             
             # 地域マスターテーブル
@@ -68,10 +383,121 @@ class WeatherDB:
                     temperature_max REAL,
                     rainfall_probability INTEGER,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    area_code TEXT,
+                    area_name TEXT,
+                    weather_code TEXT,
+                    report_datetime TEXT,
                     FOREIGN KEY (region_code) REFERENCES regions (code)
                 )
             """)
+
+            # 古いスキーマのDBに不足している列を追加
+            cursor.execute("PRAGMA table_info(forecasts)")
+            columns = {row[1] for row in cursor.fetchall()}
+            for name, column_type in FORECAST_EXTRA_COLUMNS:
+                if name not in columns:
+                    cursor.execute(
+                        f"ALTER TABLE forecasts ADD COLUMN {name} {column_type}"
+                    )
+            if "fetched_report_datetime" not in columns:
+                # 取得単位の発表時刻がない既存行は、行の発表時刻を1回の取得とみなす
+                cursor.execute("""
+                    UPDATE forecasts SET fetched_report_datetime = report_datetime
+                """)
+
+            # 一意キーを作る前に、既存の重複行を最新の1行だけ残して削除
+            cursor.execute("""
+                SELECT 1 FROM sqlite_master
+                WHERE type = 'index' AND name = 'idx_forecasts_report'
+            """)
+            if cursor.fetchone() is None:
+                cursor.execute("""
+                    DELETE FROM forecasts
+                    WHERE id NOT IN (
+                        SELECT MAX(id)
+                        FROM forecasts
+                        GROUP BY region_code, report_datetime, area_code, forecast_date
+                    )
+                """)
+
+            # 発表・地域・日付ごとに1行とする一意キー
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_forecasts_report
+                ON forecasts (region_code, report_datetime, area_code, forecast_date)
+            """)
+
+            # 最新予報の検索をインデックスだけで完結させるためのカバリングインデックス
+            # （取得単位の発表時刻で引けない旧インデックスは作り直す）
+            cursor.execute("DROP INDEX IF EXISTS idx_forecasts_latest")
+            cursor.execute("DROP INDEX IF EXISTS idx_forecasts_covering")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_forecasts_fetched
+                ON forecasts (
+                    region_code, fetched_report_datetime, area_code, forecast_date,
+                    report_datetime, created_at, weather, temperature_min,
+                    temperature_max, rainfall_probability, weather_code
+                )
+            """)
             
+            # 古い予報の整理用インデックス
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_forecasts_created
+                ON forecasts (created_at)
+            """)
+
+            # 保存期間を過ぎた予報のアーカイブ（分析用に必要な列だけを保持）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS forecast_archive (
+                    region_code TEXT NOT NULL,
+                    report_datetime TEXT NOT NULL,
+                    area_code TEXT NOT NULL,
+                    forecast_date TEXT NOT NULL,
+                    weather_code TEXT,
+                    temperature_min REAL,
+                    temperature_max REAL,
+                    rainfall_probability INTEGER,
+                    PRIMARY KEY (region_code, report_datetime, area_code, forecast_date)
+                ) WITHOUT ROWID
+            """)
+
+            # 地方〜市町村までの全階層の地域（コードは階層間で重複するため階層も主キーに含める）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS areas (
+                    level TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    en_name TEXT,
+                    kana TEXT,
+                    parent_level TEXT,
+                    parent_code TEXT,
+                    PRIMARY KEY (level, code)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_areas_parent
+                ON areas (parent_level, parent_code)
+            """)
+
+            # 各地域とそのすべての上位地域の組（閉包テーブル）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS area_ancestors (
+                    level TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    ancestor_level TEXT NOT NULL,
+                    ancestor_code TEXT NOT NULL,
+                    depth INTEGER NOT NULL,
+                    PRIMARY KEY (level, code, ancestor_level)
+                ) WITHOUT ROWID
+            """)
+
+            # 取り込み済みファイルの指紋などを保存する設定テーブル
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS app_metadata (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+
             # お気に入り地域テーブル
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS favorite_regions (
@@ -81,115 +507,1366 @@ class WeatherDB:
                 )
             """)
 
-    def clear_old_forecasts(self):
-        """古い天気予報データを削除"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                DELETE FROM forecasts 
-                WHERE created_at < datetime('now', '-1 day')
-            """)
+    def clear_old_forecasts(
+        self,
+        days=FORECAST_RETENTION_DAYS,
+        chunk_size=RETENTION_CHUNK_SIZE,
+        archive=True,
+    ):
+        """古い天気予報データを削除
+
+        ロックを長く握らないよう chunk_size 行ずつ別々のトランザクションで処理し、
+        archive が真なら削除前に forecast_archive へ移す。最後に空いたページを
+        インクリメンタルVACUUMで解放する。戻り値は削除した行数。
+        """
+        conn = self.get_connection()
+        params = {"cutoff": f"-{days} day", "chunk_size": chunk_size}
+        target = """
+            SELECT id FROM forecasts
+            WHERE created_at < datetime('now', :cutoff)
+            ORDER BY created_at
+            LIMIT :chunk_size
+        """
+        removed = 0
+        while True:
+            with conn:
+                if archive:
+                    # 発表時刻などが欠けた古い形式の行はアーカイブしない
+                    conn.execute(f"""
+                        INSERT OR IGNORE INTO forecast_archive (
+                            region_code, report_datetime, area_code, forecast_date,
+                            weather_code, temperature_min, temperature_max,
+                            rainfall_probability
+                        )
+                        SELECT region_code, report_datetime, area_code, forecast_date,
+                               weather_code, temperature_min, temperature_max,
+                               rainfall_probability
+                        FROM forecasts
+                        WHERE id IN ({target})
+                    """, params)
+                count = conn.execute(
+                    f"DELETE FROM forecasts WHERE id IN ({target})", params
+                ).rowcount
+            removed += count
+            if count < chunk_size:
+                break
+            # 他の書き込みに順番を譲る
+            time.sleep(0)
+
+        conn.execute(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES})").fetchall()
+        return removed
+
+# DBファイル名 → 共有するWeatherDB
+_weather_dbs = {}
+_weather_dbs_lock = threading.Lock()
+
+def get_weather_db(db_name=None):
+    """プロセス全体で共有するWeatherDBを取得"""
+    db_name = db_name or DB_NAME
+    with _weather_dbs_lock:
+        weather_db = _weather_dbs.get(db_name)
+        if weather_db is None:
+            weather_db = _weather_dbs[db_name] = WeatherDB(db_name)
+        return weather_db
+
+def normalize_weather_text(text):
+    """天気の文字列を WEATHER_ICONS のキーと比較できる形に正規化"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return text.replace(" ", "").replace("くもり", "曇り")
+
+class WeatherMatcher:
+    """天気の文字列に含まれるキーを最長一致で探す（Aho-Corasick法）
+
+    すべてのキーを1つのオートマトンにまとめるため、文字列の長さに比例した
+    時間で、最も長く（同じ長さなら最も前に）現れるキーが分かる。
+    """
+
+    def __init__(self, keys):
+        self._goto = [{}]
+        self._fail = [0]
+        self._longest = [None]
+
+        for key in keys:
+            node = 0
+            for char in normalize_weather_text(key):
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._longest.append(None)
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            self._longest[node] = key
+
+        # 幅優先で失敗リンクを張り、各ノードで終わる最長のキーを求める
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0) if fail or node else 0
+                if self._longest[child] is None:
+                    self._longest[child] = self._longest[self._fail[child]]
+                queue.append(child)
+
+    def match(self, text):
+        """最長一致したキーを返す（なければNone）"""
+        best = None
+        node = 0
+        for char in normalize_weather_text(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            key = self._longest[node]
+            if key is not None and (best is None or len(key) > len(best)):
+                best = key
+        return best
+
+# WEATHER_ICONS のキーから一度だけ作る照合器
+weather_matcher = WeatherMatcher(WEATHER_ICONS)
+
+# 該当なしの場合のアイコンと色
+DEFAULT_WEATHER_ICON = (ft.icons.HELP, ft.colors.BLACK)
+
+# 天気コード → アイコンと色（天気コードの名前から事前に求めておく）
+WEATHER_CODE_ICONS = {
+    code: WEATHER_ICONS.get(weather_matcher.match(name), DEFAULT_WEATHER_ICON)
+    for code, name in WEATHER_CODES.items()
+}
+
+@lru_cache(maxsize=1024)
+def get_weather_icon(weather_str, weather_code=None):
+    """天気に対応するアイコンと色を取得（文字列ごとに結果を記憶）"""
+    # 天気コードがあれば表から直接引く
+    if weather_code in WEATHER_CODE_ICONS:
+        return WEATHER_CODE_ICONS[weather_code]
+
+    # 最も長く一致したキーで検索
+    key = weather_matcher.match(weather_str)
+    if key is not None:
+        return WEATHER_ICONS[key]
 
-def get_weather_icon(weather_str):
-    # 完全一致で検索
-    if weather_str in WEATHER_ICONS:
-        return WEATHER_ICONS[weather_str]
-    
-    # 部分一致で検索
-    for key in WEATHER_ICONS:
-        if key in weather_str:
-            return WEATHER_ICONS[key]
-    
     # 該当なしの場合はデフォルト値を返す
-    return (ft.icons.HELP, ft.colors.BLACK)
+    return DEFAULT_WEATHER_ICON
+
+# アイコンの対応づけのキャッシュの効き具合（出力するときだけ集計する）
+metrics.CallbackCounter(
+    "weather_icon_cache_hits_total", "天気アイコンのキャッシュのヒット数",
+    lambda: get_weather_icon.cache_info().hits,
+)
+metrics.CallbackCounter(
+    "weather_icon_cache_misses_total", "天気アイコンのキャッシュのミス数",
+    lambda: get_weather_icon.cache_info().misses,
+)
+
+def get_metadata(key):
+    """設定テーブルから値を取得（なければNone）"""
+    conn = get_weather_db().get_connection()
+    row = conn.execute(
+        "SELECT value FROM app_metadata WHERE key = ?", (key,)
+    ).fetchone()
+    return row[0] if row else None
+
+def set_metadata(conn, key, value):
+    """設定テーブルに値を保存（呼び出し側のトランザクション内で実行）"""
+    conn.execute("""
+        INSERT INTO app_metadata (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    """, (key, value))
+
+def file_fingerprint(path, previous=None):
+    """ファイルの指紋（サイズ・更新時刻・SHA-256）を返す
+
+    サイズと更新時刻が前回と同じなら、内容のハッシュ計算を省略する。
+    """
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and all(previous.get(k) == v for k, v in fingerprint.items()):
+        fingerprint["sha256"] = previous.get("sha256")
+        return fingerprint
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+def build_area_hierarchy(area_data):
+    """areas.json の全階層から areas と area_ancestors の行を作成"""
+    area_rows = []
+    ancestors = {}
+    for depth, level in enumerate(AREA_LEVELS):
+        parent_level = AREA_LEVELS[depth - 1] if depth else None
+        for code, area in area_data.get(level, {}).items():
+            parent_code = area.get("parent") if parent_level else None
+            area_rows.append((
+                level, code, area["name"], area.get("enName"), area.get("kana"),
+                parent_level if parent_code else None, parent_code,
+            ))
+            # 親の上位地域に親自身を加えたものが、この地域の上位地域
+            chain = []
+            if parent_code:
+                chain.append((parent_level, parent_code, 1))
+                chain.extend(
+                    (ancestor_level, ancestor_code, distance + 1)
+                    for ancestor_level, ancestor_code, distance
+                    in ancestors.get((parent_level, parent_code), [])
+                )
+            ancestors[(level, code)] = chain
+
+    ancestor_rows = [
+        (level, code, ancestor_level, ancestor_code, distance)
+        for (level, code), chain in ancestors.items()
+        for ancestor_level, ancestor_code, distance in chain
+    ]
+    return area_rows, ancestor_rows
+
+def load_area_rows():
+    """areas と area_ancestors の行を取得
+
+    スナップショットがあれば、辞書に戻さず地域レコードから直接作る。
+    """
+    snapshot = area_snapshot.open_snapshot(LOCAL_AREA_FILE)
+    if snapshot is not None:
+        try:
+            return snapshot.area_rows()
+        finally:
+            snapshot.close()
+
+    with open(LOCAL_AREA_FILE, "r", encoding="utf-8") as file:
+        return build_area_hierarchy(json.load(file))
 
 def migrate_regions_to_db():
-    """JSONファイルから地域データをDBに移行"""
+    """JSONファイルから地域データをDBに移行
+
+    前回取り込んだファイルと内容が同じなら何もしない。変更があった場合は
+    差分だけを反映する（名前が変わった地域の更新と、なくなった地域の削除）。
+    """
     try:
-        # JSONファイルの読み込み
-        with open(LOCAL_AREA_FILE, "r", encoding="utf-8") as file:
-            area_data = json.load(file)
-        
-        # データベースに接続
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        # 既存のデータを削除
-        cursor.execute("DELETE FROM regions")
-        
-        # 新しいデータを挿入
-        for area_code, area in area_data["offices"].items():
-            cursor.execute(
-                "INSERT INTO regions (code, name) VALUES (?, ?)",
-                (area_code, area["name"])
+        stored = get_metadata("areas_fingerprint")
+        previous = json.loads(stored) if stored else None
+        fingerprint = file_fingerprint(LOCAL_AREA_FILE, previous)
+        conn = get_weather_db().get_connection()
+        has_areas = conn.execute("SELECT 1 FROM areas LIMIT 1").fetchone()
+        if has_areas and previous and previous.get("sha256") == fingerprint["sha256"]:
+            if previous != fingerprint:
+                # 内容は同じで更新時刻だけ変わった場合は指紋のみ更新
+                with conn:
+                    set_metadata(conn, "areas_fingerprint", json.dumps(fingerprint))
+            return True
+
+        # JSONファイルの読み込み（スナップショットがあれば使用）
+        area_rows, ancestor_rows = load_area_rows()
+        offices = [(code, name) for level, code, name, *_ in area_rows if level == "offices"]
+
+        with conn:
+            # 新しい地域の追加と、名前が変わった地域の更新
+            conn.executemany("""
+                INSERT INTO regions (code, name) VALUES (?, ?)
+                ON CONFLICT (code) DO UPDATE SET
+                    name = excluded.name,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE regions.name != excluded.name
+            """, offices)
+
+            # ファイルからなくなった地域の削除
+            current = {code for code, _ in offices}
+            existing = {code for (code,) in conn.execute("SELECT code FROM regions")}
+            conn.executemany(
+                "DELETE FROM regions WHERE code = ?",
+                [(code,) for code in existing - current],
             )
-        
-        conn.commit()
-        conn.close()
+
+            # 全階層の地域と上位地域の組は件数が少ないため作り直す
+            conn.execute("DELETE FROM areas")
+            conn.executemany(
+                "INSERT INTO areas VALUES (?, ?, ?, ?, ?, ?, ?)", area_rows
+            )
+            conn.execute("DELETE FROM area_ancestors")
+            conn.executemany(
+                "INSERT INTO area_ancestors VALUES (?, ?, ?, ?, ?)", ancestor_rows
+            )
+
+            set_metadata(conn, "areas_fingerprint", json.dumps(fingerprint))
+
+        # 地域が変わったので検索インデックスを作り直させる
+        reset_region_search_index()
         return True
     except Exception as ex:
         print(f"データ移行エラー: {ex}")
         return False
 
+def normalize_search_text(text):
+    """検索用に文字列を正規化（全角半角・大文字小文字・カタカナを統一）"""
+    text = unicodedata.normalize("NFKC", text or "").lower().replace(" ", "")
+    return "".join(
+        chr(ord(char) - 0x60) if "ァ" <= char <= "ヶ" else char for char in text
+    )
+
+class RegionSearchIndex:
+    """地域名・英語名・かなの前方一致／部分一致検索用インデックス
+
+    全地域の各文字列の接尾辞を整列して持ち、二分探索で部分一致を求める。
+    一致の種類（完全・前方・部分）、階層（予報区に近い順）、名前の短さで並べる。
+    一致が多く遅くなる短い検索（一致する接尾辞が REGION_SEARCH_PRECOMPUTE_HITS
+    件を超える接頭辞）は作成時に結果を求めておき、検索時に順位付けする件数を抑える。
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        suffixes = []
+        for index, (level, _, name, en_name, kana, _, _) in enumerate(entries):
+            for text in (name, en_name, kana):
+                key = normalize_search_text(text)
+                for start in range(len(key)):
+                    suffixes.append((key[start:], index, start, len(key)))
+        suffixes.sort()
+        self._keys = [suffix[0] for suffix in suffixes]
+        self._hits = [suffix[1:] for suffix in suffixes]
+
+        # 一致の多い接頭辞 → その接頭辞で検索したときの上位 REGION_SEARCH_LIMIT 件
+        # （一致の多い接頭辞の範囲だけを1文字長い接頭辞に分けていく）
+        self._frequent_matches = {}
+        pending = [("", 0, len(self._keys))]
+        while pending:
+            prefix, low, high = pending.pop()
+            length = len(prefix) + 1
+            while low < high:
+                key = self._keys[low]
+                if len(key) < length:
+                    # 接頭辞そのものに等しい接尾辞（範囲の先頭に並ぶ）
+                    low += 1
+                    continue
+                child = key[:length]
+                end = bisect_left(self._keys, child + "\U0010ffff", low, high)
+                if end - low > REGION_SEARCH_PRECOMPUTE_HITS:
+                    self._frequent_matches[child] = self._best_matches(
+                        length, low, end, REGION_SEARCH_LIMIT
+                    )
+                    pending.append((child, low, end))
+                low = end
+
+    def _best_matches(self, query_length, low, high, limit):
+        """接尾辞の範囲 [low, high) に一致した地域を順位順に limit 件返す"""
+        best = {}
+        for index, start, length in self._hits[low:high]:
+            if start == 0:
+                kind = 0 if length == query_length else 1
+            else:
+                kind = 2
+            level, _, name = self.entries[index][:3]
+            rank = (kind, AREA_LEVELS.index(level), len(name))
+            if index not in best or rank < best[index]:
+                best[index] = rank
+        return sorted(best, key=lambda index: (best[index], index))[:limit]
+
+    def search(self, query, limit=REGION_SEARCH_LIMIT):
+        """クエリに一致する地域を順位順に返す"""
+        query = normalize_search_text(query)
+        if not query:
+            return []
+
+        matches = self._frequent_matches.get(query)
+        if matches is not None and limit <= REGION_SEARCH_LIMIT:
+            matches = matches[:limit]
+        else:
+            low = bisect_left(self._keys, query)
+            high = bisect_left(self._keys, query + "\U0010ffff", low)
+            matches = self._best_matches(len(query), low, high, limit)
+        return [
+            RegionMatch(level, code, name, office_code, office_name)
+            for level, code, name, _, _, office_code, office_name
+            in (self.entries[index] for index in matches)
+        ]
+
+_region_search_index = None
+_region_search_index_lock = threading.Lock()
+
+def get_region_search_index():
+    """地域検索インデックスを取得（初回のみDBから作成）"""
+    global _region_search_index
+    with _region_search_index_lock:
+        if _region_search_index is None:
+            migrate_regions_to_db()
+            conn = get_weather_db().get_connection()
+            entries = conn.execute("""
+                SELECT a.level, a.code, a.name, a.en_name, a.kana,
+                       office.code, office.name
+                FROM areas a
+                LEFT JOIN area_ancestors anc
+                    ON anc.level = a.level AND anc.code = a.code
+                    AND anc.ancestor_level = 'offices'
+                JOIN areas office
+                    ON office.level = 'offices'
+                    AND office.code = CASE WHEN a.level = 'offices'
+                                           THEN a.code ELSE anc.ancestor_code END
+                ORDER BY a.level, a.code
+            """).fetchall()
+            _region_search_index = RegionSearchIndex(entries)
+        return _region_search_index
+
+def reset_region_search_index():
+    """次回の検索時に地域検索インデックスを作り直す"""
+    global _region_search_index
+    _region_search_index = None
+
+def load_office_codes():
+    """JSONファイルから予報区（offices）のコード一覧を取得（スナップショットがあれば使用）"""
+    return list(area_snapshot.load_offices(LOCAL_AREA_FILE))
+
+def get_favorite_codes_from_db():
+    """お気に入り地域のコード一覧をDBから取得"""
+    try:
+        conn = get_weather_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT region_code FROM favorite_regions")
+        return [code for (code,) in cursor.fetchall()]
+    except Exception as ex:
+        print(f"お気に入り取得エラー: {ex}")
+        return []
+
 def get_regions_from_db():
     """データベースから地域リストを取得"""
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = get_weather_db().get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT code, name FROM regions ORDER BY name")
-        regions = dict(cursor.fetchall())
-        conn.close()
-        return regions
+        return dict(cursor.fetchall())
     except Exception as ex:
         print(f"地域データ取得エラー: {ex}")
         return None
 
-def save_forecast_to_db(region_code, forecasts):
-    """天気予報データをDBに保存"""
+def last_publish_time(now=None):
+    """直近の気象庁定時発表時刻（JST）を返す"""
+    now = now or datetime.now(JST)
+    for hour in reversed(JMA_PUBLISH_HOURS):
+        candidate = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if candidate <= now:
+            return candidate
+    previous_day = now - timedelta(days=1)
+    return previous_day.replace(
+        hour=JMA_PUBLISH_HOURS[-1], minute=0, second=0, microsecond=0
+    )
+
+def next_publish_time(now=None):
+    """次の気象庁定時発表時刻（JST）を返す"""
+    now = now or datetime.now(JST)
+    for hour in JMA_PUBLISH_HOURS:
+        candidate = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if candidate > now:
+            return candidate
+    next_day = now + timedelta(days=1)
+    return next_day.replace(
+        hour=JMA_PUBLISH_HOURS[0], minute=0, second=0, microsecond=0
+    )
+
+def is_current_report(report_datetime, now=None):
+    """予報の発表時刻が直近の定時発表以降か（発表が遅れて前回の予報が返った場合は偽）"""
+    if not report_datetime:
+        return False
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        for date, weather in forecasts:
-            cursor.execute("""
-                INSERT INTO forecasts (region_code, forecast_date, weather)
-                VALUES (?, ?, ?)
-            """, (region_code, date, weather))
-        
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as ex:
-        print(f"天気予報保存エラー: {ex}")
+        reported = datetime.fromisoformat(report_datetime)
+    except ValueError:
         return False
+    if reported.tzinfo is None:
+        reported = reported.replace(tzinfo=JST)
+    return reported >= last_publish_time(now)
+
+def forecast_expiry(report_datetime, now=None):
+    """予報をキャッシュしてよい期限
+
+    直近の定時発表の予報なら次の定時発表まで、前回の発表のままなら
+    FORECAST_RETRY_TTL 秒後（新しい発表が出たらすぐ取り直すため）。
+    """
+    now = now or datetime.now(JST)
+    if is_current_report(report_datetime, now):
+        return next_publish_time(now)
+    return min(now + timedelta(seconds=FORECAST_RETRY_TTL), next_publish_time(now))
+
+def rows_report_datetime(rows):
+    """1回の取得で得た ForecastRow の発表時刻（行がなければNone）"""
+    return rows[0].fetched_report_datetime if rows else None
+
+class ForecastCache:
+    """地域コードごとの予報を保持するLRUキャッシュ
+
+    各エントリの期限は予報の発表時刻で決める。直近の定時発表の予報は
+    次の定時発表時刻で失効し、発表の遅れで前回の予報しか取れなかった
+    場合は短い時間で失効するため、新しい発表があった後に古い予報を
+    返し続けることはない。
+    """
+
+    def __init__(self, maxsize=FORECAST_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, region_code):
+        """有効なキャッシュを返す（なければNone）"""
+        with self._lock:
+            entry = self._entries.get(region_code)
+            if entry is None:
+                CACHE_REQUESTS.inc("miss")
+                return None
+            forecasts, expires_at = entry
+            if datetime.now(JST) >= expires_at:
+                del self._entries[region_code]
+                CACHE_REQUESTS.inc("miss")
+                return None
+            self._entries.move_to_end(region_code)
+            CACHE_REQUESTS.inc("hit")
+            return forecasts
+
+    def get_many(self, region_codes, count=True):
+        """複数地域の有効なキャッシュを1回のロックでまとめて返す（地域コード → 予報）
+
+        同じ要求の中での確認し直しなど、参照数に数えない場合は count を偽にする。
+        """
+        now = datetime.now(JST)
+        results = {}
+        with self._lock:
+            for region_code in region_codes:
+                entry = self._entries.get(region_code)
+                if entry is None:
+                    continue
+                forecasts, expires_at = entry
+                if now >= expires_at:
+                    del self._entries[region_code]
+                    continue
+                self._entries.move_to_end(region_code)
+                results[region_code] = forecasts
+        if count:
+            CACHE_REQUESTS.inc("hit", amount=len(results))
+            CACHE_REQUESTS.inc("miss", amount=len(region_codes) - len(results))
+        return results
+
+    def set(self, region_code, forecasts, report_datetime):
+        """予報を発表時刻に応じた期限つきで登録し、上限を超えたら最も古く使われた地域を削除"""
+        expires_at = forecast_expiry(report_datetime)
+        with self._lock:
+            self._entries[region_code] = (forecasts, expires_at)
+            self._entries.move_to_end(region_code)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, region_code=None):
+        """指定地域（省略時は全地域）のキャッシュを破棄"""
+        with self._lock:
+            if region_code is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(region_code, None)
+
+# プロセス全体で共有する予報キャッシュ
+forecast_cache = ForecastCache()
+
+class WriteTicket:
+    """書き込み依頼の控え（DBに書き込まれたかを確認できる）"""
+
+    def __init__(self):
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def durable(self):
+        """DBへの書き込みが完了したか"""
+        return self._done.is_set() and self.error is None
+
+    def wait(self, timeout=None):
+        """書き込みの完了を待ち、書き込めたかどうかを返す"""
+        self._done.wait(timeout)
+        return self.durable
+
+    def _finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+class ForecastWriter:
+    """予報のDBへの保存を1つのバックグラウンドスレッドにまとめる（ライトビハインド）
+
+    依頼した時点でキャッシュに入れて呼び出し元にはすぐ戻り、書き込みは
+    上限つきのキューから取り出して複数地域分を1回のトランザクションで
+    まとめてコミットする。キューがいっぱいのときは空くまで待たせる。
+    """
+
+    def __init__(self, maxsize=WRITE_QUEUE_SIZE, batch_size=WRITE_BATCH_SIZE,
+                 batch_delay=WRITE_BATCH_DELAY):
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """書き込みスレッドを開始（開始済みなら何もしない）"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="forecast-writer", daemon=True
+            )
+            self._thread.start()
+
+    @property
+    def pending(self):
+        """書き込み待ちの件数"""
+        return self._queue.qsize()
+
+    def submit(self, region_code, rows, block=True):
+        """予報の保存を依頼し、控えを返す
+
+        block が偽でキューがいっぱいなら queue.Full を送出する。
+        """
+        ticket = WriteTicket()
+        self.start()
+        self._queue.put((region_code, rows, ticket), block=block)
+        forecast_cache.set(region_code, primary_area_forecasts(rows), rows_report_datetime(rows))
+        return ticket
+
+    def flush(self, timeout=None):
+        """それまでに依頼された書き込みがすべて終わるまで待つ"""
+        if not (self._thread and self._thread.is_alive()):
+            return True
+        ticket = WriteTicket()
+        self._queue.put((None, None, ticket))
+        return ticket.wait(timeout)
+
+    def stop(self, timeout=None):
+        """書き込み待ちをすべて保存してからスレッドを停止"""
+        if not (self._thread and self._thread.is_alive()):
+            return
+        self._queue.put((None, None, None))
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_delay
+            # 区切り（flush/stop）が来るまで、少し待って他の地域の書き込みもまとめる
+            while len(batch) < self.batch_size and batch[-1][0] is not None:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                                 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self._commit(batch):
+                return
+
+    def _commit(self, batch):
+        """まとめた書き込みを1回のトランザクションで保存（停止の依頼があれば真）"""
+        writes = [(region_code, rows) for region_code, rows, _ in batch if region_code]
+        error = None
+        if writes:
+            WRITE_BATCH_SIZE_HISTOGRAM.observe(len(writes))
+            try:
+                conn = get_weather_db().get_connection()
+                with DB_SECONDS.time("write"), conn:
+                    conn.executemany(INSERT_FORECAST_SQL, [
+                        (region_code, *row) for region_code, rows in writes for row in rows
+                    ])
+            except Exception as ex:
+                error = ex
+                ERRORS.inc("db_write")
+                print(f"天気予報保存エラー: {ex}")
+
+        stop = False
+        for region_code, _, ticket in batch:
+            if ticket is None:
+                stop = True
+            elif region_code:
+                ticket._finish(error)
+            else:
+                ticket._finish()
+        return stop
+
+# プロセス全体で共有する書き込みスレッド（終了時に書き込み待ちを保存する）
+forecast_writer = ForecastWriter()
+atexit.register(forecast_writer.stop)
+
+metrics.CallbackGauge(
+    "forecast_write_queue_depth", "書き込み待ちの件数", lambda: forecast_writer.pending
+)
 
 def get_latest_forecast_from_db(region_code):
-    """指定地域の最新の天気予報をDBから取得"""
+    """指定地域の最新の天気予報をDBから取得
+
+    直近の定時発表以降に発表された最新の予報のうち、代表地域（最小の
+    地域コード）の (日付, 天気, 最低気温, 最高気温, 降水確率, 天気コード)
+    のリストを返す。
+    メモリ上のキャッシュにあればDBには問い合わせない。
+    画面がキャッシュを確認した後の確認し直しに使うため、キャッシュの参照数には数えない。
+    """
+    return get_latest_forecasts_from_db([region_code], count=False).get(region_code)
+
+def get_latest_forecasts_from_db(region_codes, count=True):
+    """複数地域の最新の天気予報を1回の問い合わせでまとめて取得
+
+    キャッシュにある地域はキャッシュから返し、残りの地域だけを1つのSQLで
+    DBに問い合わせる。戻り値は 地域コード → 表示用の予報 の辞書で、
+    直近の定時発表以降の予報がない地域は含まない。
+    count が偽ならキャッシュの参照数に数えない。
+    """
+    region_codes = list(dict.fromkeys(region_codes))
+    results = forecast_cache.get_many(region_codes, count)
+    missing = [code for code in region_codes if code not in results]
+    if not missing:
+        return results
+
+    # 取得した時刻ではなく発表時刻で判断する（発表が遅れた場合は前回の予報が返るため）
+    # 発表時刻は気象庁と同じ "YYYY-MM-DDTHH:MM:SS+09:00" の形で保存されている
+    # 週間予報の行は3日間予報より古い発表時刻を持つことがあるので、
+    # 最新の取得は行ごとの発表時刻ではなく fetched_report_datetime で選ぶ
+    since = last_publish_time().isoformat()
+    targets = ", ".join("(?)" for _ in missing)
+    start = time.perf_counter()
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = get_weather_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH targets(region_code) AS (VALUES {targets}),
+            latest AS (
+                SELECT t.region_code, (
+                    SELECT f.fetched_report_datetime
+                    FROM forecasts f
+                    WHERE f.region_code = t.region_code
+                    AND f.fetched_report_datetime >= ?
+                    ORDER BY f.fetched_report_datetime DESC
+                    LIMIT 1
+                ) AS fetched_report_datetime
+                FROM targets t
+            ),
+            primary_area AS (
+                SELECT l.region_code, l.fetched_report_datetime, (
+                    SELECT MIN(f.area_code)
+                    FROM forecasts f
+                    WHERE f.region_code = l.region_code
+                    AND f.fetched_report_datetime = l.fetched_report_datetime
+                ) AS area_code
+                FROM latest l
+                WHERE l.fetched_report_datetime IS NOT NULL
+            )
+            SELECT f.region_code, f.fetched_report_datetime, f.forecast_date, f.weather,
+                   f.temperature_min, f.temperature_max, f.rainfall_probability,
+                   f.weather_code
+            FROM primary_area p
+            JOIN forecasts f
+            ON f.region_code = p.region_code
+            AND f.fetched_report_datetime = p.fetched_report_datetime
+            AND f.area_code = p.area_code
+            ORDER BY f.region_code, f.forecast_date
+        """, (*missing, since))
+
+        found = {}
+        reported = {}
+        for region_code, report_datetime, *forecast in cursor:
+            found.setdefault(region_code, []).append(tuple(forecast))
+            reported[region_code] = report_datetime
+        DB_SECONDS.observe(time.perf_counter() - start, "latest")
+        for region_code, forecasts in found.items():
+            forecast_cache.set(region_code, forecasts, reported[region_code])
+        results.update(found)
+    except Exception as ex:
+        ERRORS.inc("db_query")
+        print(f"天気予報取得エラー: {ex}")
+    return results
+
+def get_stale_forecast_from_db(region_code):
+    """指定地域の、保存されている中で最新の天気予報を古さに関わらず取得
+
+    新しい予報を取得できないときの代わりに表示する。戻り値は
+    (表示用の予報のリスト, 発表時刻) のタプル（なければNone）。
+    保存し直すと作成時刻は更新されるため、古さは発表時刻で表す。
+    """
+    start = time.perf_counter()
+    try:
+        conn = get_weather_db().get_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT forecast_date, weather
+            WITH latest AS (
+                SELECT fetched_report_datetime
+                FROM forecasts
+                WHERE region_code = :region_code
+                AND fetched_report_datetime IS NOT NULL
+                ORDER BY fetched_report_datetime DESC
+                LIMIT 1
+            ),
+            primary_area AS (
+                SELECT MIN(area_code) AS area_code
+                FROM forecasts
+                WHERE region_code = :region_code
+                AND fetched_report_datetime = (
+                    SELECT fetched_report_datetime FROM latest
+                )
+            )
+            SELECT forecast_date, weather, temperature_min, temperature_max,
+                   rainfall_probability, weather_code, fetched_report_datetime
             FROM forecasts
-            WHERE region_code = ?
-            AND created_at >= datetime('now', '-1 hour')
-            ORDER BY created_at DESC
-        """, (region_code,))
-        forecasts = cursor.fetchall()
-        conn.close()
-        return forecasts if forecasts else None
+            WHERE region_code = :region_code
+            AND fetched_report_datetime = (SELECT fetched_report_datetime FROM latest)
+            AND area_code = (SELECT area_code FROM primary_area)
+            ORDER BY forecast_date
+        """, {"region_code": region_code})
+        rows = cursor.fetchall()
+        DB_SECONDS.observe(time.perf_counter() - start, "stale")
+        if not rows:
+            return None
+        reported_at = datetime.fromisoformat(rows[0][-1])
+        if reported_at.tzinfo is None:
+            reported_at = reported_at.replace(tzinfo=JST)
+        return [row[:-1] for row in rows], reported_at
     except Exception as ex:
+        ERRORS.inc("db_query")
         print(f"天気予報取得エラー: {ex}")
         return None
 
+def format_age(reported_at):
+    """発表時刻からの経過時間の表示文字列"""
+    minutes = int((datetime.now(timezone.utc) - reported_at).total_seconds() // 60)
+    if minutes < 60:
+        return f"{max(minutes, 0)}分前"
+    if minutes < 24 * 60:
+        return f"{minutes // 60}時間前"
+    return f"{minutes // (24 * 60)}日前"
+
+def _to_number(value, cast=float):
+    """APIの文字列値を数値に変換（空文字などはNone）"""
+    if value is None or value == "":
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        return None
+
+def parse_forecast(forecast_data):
+    """APIレスポンス全体を1回走査して ForecastRow のリストに正規化
+
+    3日間予報・週間予報のすべてのtimeSeriesと地域を、timeDefinesの日付で
+    揃えて1行にまとめる。値は先に現れた（より詳しい）予報を優先し、
+    降水確率は同じ予報内の1日の最大値とする。
+    各行には行を作ったブロックの発表時刻と、取得の単位となる先頭
+    （3日間予報）の発表時刻の両方を付ける。
+    """
+    rows = {}
+    pop_sources = {}
+    fetched_report_datetime = forecast_data[0].get("reportDatetime") if forecast_data else None
+
+    for block_index, block in enumerate(forecast_data):
+        report_datetime = block.get("reportDatetime")
+        # 天気を持つ予報区（気温の観測点と同じ順序で並ぶ）
+        weather_areas = []
+
+        for series in block.get("timeSeries", []):
+            time_defines = series["timeDefines"]
+            areas = series["areas"]
+            if not weather_areas and areas and "weatherCodes" in areas[0]:
+                weather_areas = [area["area"] for area in areas]
+
+            for index, area_data in enumerate(areas):
+                if "weatherCodes" in area_data or "pops" in area_data:
+                    area = area_data["area"]
+                elif weather_areas:
+                    # 気温は観測点単位のため、同じ順序の予報区に割り当てる
+                    area = weather_areas[min(index, len(weather_areas) - 1)]
+                else:
+                    continue
+
+                weathers = area_data.get("weathers", [])
+                codes = area_data.get("weatherCodes", [])
+                pops = area_data.get("pops", [])
+                temps = area_data.get("temps", [])
+                temps_min = area_data.get("tempsMin", [])
+                temps_max = area_data.get("tempsMax", [])
+
+                for i, time_define in enumerate(time_defines):
+                    date = time_define[:10]
+                    key = (area["code"], date)
+                    row = rows.get(key)
+                    if row is None:
+                        row = rows[key] = {
+                            "area_code": area["code"],
+                            "area_name": area["name"],
+                            "forecast_date": date,
+                            "weather": None,
+                            "weather_code": None,
+                            "temperature_min": None,
+                            "temperature_max": None,
+                            "rainfall_probability": None,
+                            "report_datetime": report_datetime,
+                            "fetched_report_datetime": fetched_report_datetime,
+                        }
+
+                    if i < len(codes) and codes[i] and row["weather_code"] is None:
+                        row["weather_code"] = codes[i]
+                        if i < len(weathers):
+                            row["weather"] = weathers[i]
+                        else:
+                            row["weather"] = WEATHER_CODES.get(codes[i], codes[i])
+
+                    pop = _to_number(pops[i], int) if i < len(pops) else None
+                    if pop is not None and pop_sources.get(key, block_index) == block_index:
+                        pop_sources[key] = block_index
+                        current = row["rainfall_probability"]
+                        row["rainfall_probability"] = pop if current is None else max(current, pop)
+
+                    # 3日間予報の気温は 00時が最低、09時が最高
+                    temp = _to_number(temps[i]) if i < len(temps) else None
+                    if temp is not None:
+                        name = "temperature_min" if time_define[11:13] == "00" else "temperature_max"
+                        if row[name] is None:
+                            row[name] = temp
+
+                    temp_min = _to_number(temps_min[i]) if i < len(temps_min) else None
+                    if temp_min is not None and row["temperature_min"] is None:
+                        row["temperature_min"] = temp_min
+                    temp_max = _to_number(temps_max[i]) if i < len(temps_max) else None
+                    if temp_max is not None and row["temperature_max"] is None:
+                        row["temperature_max"] = temp_max
+
+    return [ForecastRow(**row) for row in rows.values() if row["weather"]]
+
+def primary_area_forecasts(rows):
+    """代表地域（最小の地域コード）の予報を表示用のタプルに変換"""
+    if not rows:
+        return []
+    area_code = min(row.area_code for row in rows)
+    return [
+        (row.forecast_date, row.weather, row.temperature_min,
+         row.temperature_max, row.rainfall_probability, row.weather_code)
+        for row in sorted(rows, key=lambda row: row.forecast_date)
+        if row.area_code == area_code
+    ]
+
+# プロセス全体で共有する予報の取得クライアント
+# （レート制限と再試行の予算は他のデータソースと共有する）
+forecast_client = jma_fetcher.SourceClient("forecast")
+
+def request_forecast(region_code):
+    """APIから指定地域の天気予報を取得
+
+    戻り値は (ForecastRowのリスト, 前回から更新があったかどうか) のタプル。
+    """
+    forecast_data, modified = forecast_client.fetch(region_code)
+    return parse_forecast(forecast_data), modified
+
+def prefetch_all_forecasts(region_codes=None, max_workers=PREFETCH_MAX_WORKERS):
+    """全予報区の天気予報を並列に取得し、DBへまとめて保存
+
+    リクエストはスレッドプールで同時に発行するため、全体の所要時間は
+    最も遅い1件のリクエストとほぼ同じになる。
+    前回から更新がなかった（304）地域は保存を省略する。
+    戻り値は (地域コード→予報リスト, 地域コード→例外) のタプル。
+    """
+    if region_codes is None:
+        region_codes = load_office_codes()
+
+    results = {}
+    updated = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(request_forecast, code): code for code in region_codes
+        }
+        for future in as_completed(futures):
+            code = futures[future]
+            try:
+                forecasts, modified = future.result()
+                results[code] = forecasts
+                if modified:
+                    updated[code] = forecasts
+                else:
+                    forecast_cache.set(
+                        code, primary_area_forecasts(forecasts), rows_report_datetime(forecasts)
+                    )
+            except Exception as ex:
+                errors[code] = ex
+                ERRORS.inc("prefetch")
+                print(f"天気予報取得エラー({code}): {ex}")
+
+    # 更新があった分は書き込みスレッドがまとめて保存する
+    for code, forecasts in updated.items():
+        forecast_writer.submit(code, forecasts)
+    return results, errors
+
+# 段階ごとのスレッドプール。気象庁APIの待ち（レート制限・再試行）でスレッドが
+# 埋まっても、DB確認と解析が順番待ちで制限時間を使い切らないよう分けておく。
+# 古い予報の読み出しは障害時の頼みの綱なので、さらに専用のスレッドで行う
+_lookup_executor = ThreadPoolExecutor(STAGE_LOOKUP_WORKERS, thread_name_prefix="forecast-lookup")
+_fetch_executor = ThreadPoolExecutor(STAGE_FETCH_WORKERS, thread_name_prefix="forecast-fetch")
+_stale_executor = ThreadPoolExecutor(STAGE_STALE_WORKERS, thread_name_prefix="forecast-stale")
+_stage_executors = {
+    "cache": _lookup_executor,
+    "fetch": _fetch_executor,
+    "parse": _lookup_executor,
+    "stale": _stale_executor,
+}
+
+async def run_stage(stage, func, *args):
+    """処理を段階ごとのスレッドプールで実行し、段階ごとの制限時間を超えたら打ち切る"""
+    loop = asyncio.get_running_loop()
+    with STAGE_SECONDS.time(stage):
+        return await asyncio.wait_for(
+            loop.run_in_executor(_stage_executors[stage], func, *args),
+            STAGE_TIMEOUTS[stage],
+        )
+
+async def run_lookup_stage(stage, func, *args):
+    """DB確認の段階を実行（制限時間を超えたらNoneを返し、次の手段に進ませる）"""
+    try:
+        return await run_stage(stage, func, *args)
+    except asyncio.TimeoutError:
+        ERRORS.inc(f"{stage}_timeout")
+        return None
+
+async def _load_forecast(region_code):
+    """DB確認・取得・解析・保存を段階ごとの制限時間つきで行い、表示用の予報を返す"""
+    # 他のセッションが直前に保存していればそれを使う（確認が遅ければ取得に進む）
+    forecasts = await run_lookup_stage("cache", get_latest_forecast_from_db, region_code)
+    if forecasts:
+        return forecasts
+
+    # APIから新しい予報を取得して解析（取得処理にも期限を渡し、期限後は再試行しない）
+    deadline = time.monotonic() + STAGE_TIMEOUTS["fetch"]
+    forecast_data, modified = await run_stage(
+        "fetch", forecast_client.fetch, region_code, deadline
+    )
+    rows = await run_stage("parse", parse_forecast, forecast_data)
+    forecasts = primary_area_forecasts(rows)
+
+    # 更新があった場合のみ予報データをDBに保存（書き込みスレッドに任せて待たない）
+    if modified:
+        try:
+            forecast_writer.submit(region_code, rows, block=False)
+        except queue.Full:
+            # 書き込みが詰まっているときだけ、空くまで別スレッドで待つ
+            await asyncio.to_thread(forecast_writer.submit, region_code, rows)
+    else:
+        forecast_cache.set(region_code, forecasts, rows_report_datetime(rows))
+    return forecasts
+
+# (イベントループ, 地域コード) → 実行中の共有取得タスク
+_inflight_forecasts = {}
+
+def _finish_inflight_forecast(key, task):
+    """共有取得タスクの終了時に登録を外す（誰も待っていない例外も回収する）"""
+    if _inflight_forecasts.get(key) is task:
+        del _inflight_forecasts[key]
+    if not task.cancelled():
+        task.exception()
+
+def _shared_forecast_task(region_code):
+    """指定地域の共有取得タスク（実行中のものがなければ開始する）"""
+    loop = asyncio.get_running_loop()
+    key = (loop, region_code)
+    task = _inflight_forecasts.get(key)
+    if task is None:
+        task = loop.create_task(_load_forecast(region_code))
+        _inflight_forecasts[key] = task
+        task.add_done_callback(lambda done: _finish_inflight_forecast(key, done))
+    return task
+
+async def load_forecast_shared(region_code):
+    """表示用の予報を取得（同じ地域への同時の要求は1回の取得にまとめる）
+
+    Webモードでは全セッションが同じイベントループで動くため、同時に同じ地域を
+    開いても気象庁APIへのリクエストとDBへの保存は1回で済む。呼び出し側が
+    取り消されても、共有タスクは他の待ち手のために続行する。
+    """
+    return await asyncio.shield(_shared_forecast_task(region_code))
+
+async def load_forecast_stale_while_revalidate(region_code):
+    """表示用の予報をすぐに返し、古ければ裏で取得し直す
+
+    直近の定時発表以降の予報があればそれを返す。なければ保存されている中で
+    最新の予報を返しつつ共有取得タスクを開始する（待ち手がいなくても続行し、
+    結果はDBとキャッシュに入る）。保存された予報が全くない場合だけ取得を待つ。
+    戻り値は (予報, 古い予報の発表時刻（新しい予報ならNone）)。
+    """
+    forecasts = await run_lookup_stage("cache", get_latest_forecast_from_db, region_code)
+    if forecasts:
+        return forecasts, None
+
+    # 気象庁APIの障害でも応答が遅れないよう、取得とは別のスレッドで読み出す
+    stale = await run_lookup_stage("stale", get_stale_forecast_from_db, region_code)
+    if stale is not None:
+        _shared_forecast_task(region_code)
+        return stale
+
+    return await load_forecast_shared(region_code), None
+
+async def load_forecasts_batch(region_codes):
+    """複数地域の表示用の予報をまとめて取得
+
+    キャッシュとDBは1回の問い合わせで確認し、見つからなかった地域だけを
+    並行して取得する。戻り値は (地域コード → 予報, 地域コード → 例外)。
+    """
+    region_codes = list(dict.fromkeys(region_codes))
+    results = await run_lookup_stage("cache", get_latest_forecasts_from_db, region_codes) or {}
+    missing = [code for code in region_codes if code not in results]
+
+    errors = {}
+    fetched = await asyncio.gather(
+        *(load_forecast_shared(code) for code in missing), return_exceptions=True
+    )
+    for region_code, forecasts in zip(missing, fetched):
+        if isinstance(forecasts, asyncio.CancelledError):
+            raise forecasts
+        if isinstance(forecasts, BaseException):
+            errors[region_code] = forecasts
+        else:
+            results[region_code] = forecasts
+    return results, errors
+
+async def warm_forecast(region_code):
+    """指定地域の予報をキャッシュに用意する（なければ1地域だけ取得し、失敗は記録のみ）"""
+    try:
+        _, errors = await load_forecasts_batch([region_code])
+    except Exception as ex:
+        errors = {region_code: ex}
+    for code, ex in errors.items():
+        ERRORS.inc("favorite_refresh")
+        print(f"お気に入り更新エラー({code}): {ex}")
+
+class FavoriteRefresher:
+    """定時発表の直後にお気に入り地域の予報を取得し、キャッシュを温めておく
+
+    デーモンスレッドで動作し、開始時刻にランダムな揺らぎを加え、
+    同時リクエスト数を制限して気象庁APIへの集中を避ける。
+    """
+
+    def __init__(
+        self,
+        delay=FAVORITE_REFRESH_DELAY,
+        jitter=FAVORITE_REFRESH_JITTER,
+        max_workers=FAVORITE_REFRESH_MAX_WORKERS,
+    ):
+        self.delay = delay
+        self.jitter = jitter
+        self.max_workers = max_workers
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self):
+        """更新スレッドを開始（開始済みなら何もしない）"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="favorite-refresher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """更新スレッドを停止"""
+        self._stop.set()
+        self._wake.set()
+
+    def seconds_until_next_run(self):
+        """次の更新（定時発表 + 待ち時間 + 揺らぎ）までの秒数"""
+        now = datetime.now(JST)
+        delay = timedelta(seconds=self.delay)
+        run_at = next_publish_time(now - delay) + delay
+        return (run_at - now).total_seconds() + random.uniform(0, self.jitter)
+
+    def refresh(self):
+        """お気に入り地域の予報を取得してDBとキャッシュに保存"""
+        codes = get_favorite_codes_from_db()
+        if codes:
+            prefetch_all_forecasts(codes, max_workers=self.max_workers)
+
+    def _run(self):
+        # 起動直後に一度温めておく
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as ex:
+                ERRORS.inc("favorite_refresh")
+                print(f"お気に入り更新エラー: {ex}")
+            self._wake.wait(self.seconds_until_next_run())
+            self._wake.clear()
+
+# プロセス全体で共有するお気に入り更新スレッド
+favorite_refresher = FavoriteRefresher()
+
+class RetentionScheduler:
+    """一定間隔で古い予報をアーカイブへ移し、DBを小さく保つ"""
+
+    def __init__(self, interval=RETENTION_INTERVAL):
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """整理スレッドを開始（開始済みなら何もしない）"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="forecast-retention", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """整理スレッドを停止"""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                get_weather_db().clear_old_forecasts()
+            except Exception as ex:
+                ERRORS.inc("retention")
+                print(f"予報データ整理エラー: {ex}")
+            self._stop.wait(self.interval)
+
+# プロセス全体で共有する整理スレッド
+retention_scheduler = RetentionScheduler()
+
+def favorites_snapshot_path():
+    """お気に入り一覧のスナップショットのパス（DBファイルの隣に置く）"""
+    return DB_NAME + ".favorites.json"
+
+def load_favorites_snapshot():
+    """前回表示したお気に入り一覧 [(コード, 名前), ...] を読み込む（なければ空）"""
+    try:
+        with open(favorites_snapshot_path(), "r", encoding="utf-8") as file:
+            return [tuple(favorite) for favorite in json.load(file)]
+    except (OSError, ValueError):
+        return []
+
+def save_favorites_snapshot(favorites):
+    """お気に入り一覧のスナップショットを保存"""
+    path = favorites_snapshot_path()
+    # 複数のセッションが同時に保存しても一時ファイルが重ならないようにする
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump([list(favorite) for favorite in favorites], file, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except OSError as ex:
+        print(f"お気に入りスナップショット保存エラー: {ex}")
+
+# 初回描画までの時間を表示済みか（プロセスで最初のセッションのみ表示）
+_first_paint_reported = False
+
+def report_first_paint(main_started):
+    """初回描画までの時間を表示"""
+    global _first_paint_reported
+    now = time.perf_counter()
+    message = f"初回描画: main開始から {(now - main_started) * 1000:.0f}ms"
+    if not _first_paint_reported:
+        _first_paint_reported = True
+        message += f"（プロセス開始から {(now - PROCESS_START) * 1000:.0f}ms）"
+    print(message)
+
+def format_forecast_details(temp_min, temp_max, rainfall):
+    """気温・降水確率の表示文字列（取得できたものだけ）"""
+    details = []
+    if temp_min is not None or temp_max is not None:
+        details.append(
+            f"{'-' if temp_min is None else f'{temp_min:g}'}℃ / "
+            f"{'-' if temp_max is None else f'{temp_max:g}'}℃"
+        )
+    if rainfall is not None:
+        details.append(f"降水確率 {rainfall}%")
+    return "  ".join(details)
+
+class ForecastCard:
+    """1日分の天気予報カード
+
+    コントロールは作り直さずに使い回し、予報が変わったときだけ
+    該当するプロパティを書き換える。
+    """
+
+    def __init__(self, date):
+        self.forecast = None
+        self.date_text = ft.Text(date, size=18, weight=ft.FontWeight.BOLD)
+        self.icon = ft.Icon(size=40)
+        self.weather_text = ft.Text(size=16)
+        self.details_text = ft.Text(size=14)
+        self.control = ft.Card(
+            content=ft.Container(
+                ft.Column(
+                    [self.date_text, self.icon, self.weather_text, self.details_text],
+                    alignment=ft.MainAxisAlignment.CENTER,
+                    spacing=5,
+                ),
+                padding=10,
+                alignment=ft.alignment.center,
+            )
+        )
+
+    def set_forecast(self, forecast):
+        """予報を反映（変化がなければ何もしない）"""
+        if forecast == self.forecast:
+            return False
+        date, weather, temp_min, temp_max, rainfall, weather_code = forecast
+        icon, color = get_weather_icon(weather, weather_code)
+        self.date_text.value = date
+        self.icon.name = icon
+        self.icon.color = color
+        self.weather_text.value = weather
+        self.weather_text.color = color
+        self.details_text.value = format_forecast_details(temp_min, temp_max, rainfall)
+        self.forecast = forecast
+        return True
+
+class ForecastView:
+    """天気予報欄（日付ごとのカードを使い回し、変わった所だけ更新）"""
+
+    def __init__(self):
+        self.column = ft.Column(spacing=10)
+        # 日付 → 表示中の予報カード
+        self.cards = {}
+        # 古い予報を表示しているときの注意書き
+        self.stale_notice = ft.Text(color=ft.colors.ORANGE)
+
+    def display(self, forecasts, notice=None):
+        """天気予報を表示（notice があれば注意書きを先頭に付ける）"""
+        start = time.perf_counter()
+        dates = []
+        for forecast in forecasts:
+            date = forecast[0]
+            card = self.cards.get(date)
+            if card is None:
+                card = self.cards[date] = ForecastCard(date)
+            card.set_forecast(forecast)
+            dates.append(date)
+
+        # 表示しなくなった日付のカードを破棄
+        for date in set(self.cards) - set(dates):
+            del self.cards[date]
+
+        controls = [self.cards[date].control for date in dates]
+        if notice:
+            self.stale_notice.value = notice
+            controls.insert(0, self.stale_notice)
+        if self.column.controls != controls:
+            self.column.controls = controls
+        STAGE_SECONDS.observe(time.perf_counter() - start, "render")
+        with STAGE_SECONDS.time("page_update"):
+            self.column.update()
+
+    def show_message(self, text, color):
+        """天気予報欄にメッセージを表示"""
+        self.column.controls = [ft.Text(text, color=color)]
+        self.column.update()
+
 def main(page: ft.Page):
+    main_started = time.perf_counter()
+    ACTIVE_SESSIONS.inc()
     page.title = "天気予報アプリ"
     page.scroll = ft.ScrollMode.AUTO
     page.spacing = 10
     page.padding = 20
 
-    weather_db = WeatherDB()
-
     def handle_region_expansion(e):
         """地域選択のExpansionTileの展開/折りたたみ時のハンドラ"""
         page.show_snack_
@@ -225,13 +1902,46 @@ def main(page: ft.Page):
         disabled=True,
     )
 
-    forecast_result = ft.Column(spacing=10)
+    forecast_view = ForecastView()
+    forecast_result = forecast_view.column
     favorite_regions = ft.Column(spacing=10)
+    comparison_result = ft.Column(spacing=10)
+    search_results = ft.Column(spacing=0)
+
+    def search_regions(e):
+        """入力された文字で地域を検索して候補を表示"""
+        search_results.controls.clear()
+        for match in get_region_search_index().search(e.control.value):
+            subtitle = "" if match.code == match.office_code else match.office_name
+            search_results.controls.append(
+                ft.ListTile(
+                    leading=ft.Icon(ft.icons.SEARCH),
+                    title=ft.Text(match.name),
+                    subtitle=ft.Text(subtitle) if subtitle else None,
+                    on_click=lambda e, m=match: select_search_result(m),
+                )
+            )
+        search_results.update()
+
+    def select_search_result(match):
+        """検索候補の予報区を選択して天気予報を表示"""
+        region_dropdown.value = match.office_code
+        fetch_button.disabled = False
+        search_results.controls.clear()
+        page.update()
+        fetch_forecast(match.office_code)
+
+    search_field = ft.TextField(
+        label="地域名・よみがな・英語名で検索",
+        prefix_icon=ft.icons.SEARCH,
+        width=400,
+        on_change=search_regions,
+    )
 
     def fetch_regions(e):
         """地域リストを取得してUIに更新（DB版）"""
         # DBの初期化
-        weather_db.init_database()
+        get_weather_db().init_database()
         
         # 初回のみJSONからDBへの移行を実行
         migrate_regions_to_db()
@@ -251,73 +1961,76 @@ def main(page: ft.Page):
             )
             page.update()
 
-    def display_forecasts(forecasts):
-        """天気予報の表示処理"""
-        forecast_result.controls.clear()
-        
-        for date, weather in forecasts:
-            icon, color = get_weather_icon(weather)
-            
-            card = ft.Card(
-                content=ft.Container(
-                    ft.Column(
-                        [
-                            ft.Text(date, size=18, weight=ft.FontWeight.BOLD),
-                            ft.Icon(icon, size=40, color=color),
-                            ft.Text(weather, size=16, color=color),
-                        ],
-                        alignment=ft.MainAxisAlignment.CENTER,
-                        spacing=5,
-                    ),
-                    padding=10,
-                    alignment=ft.alignment.center,
-                )
-            )
-            forecast_result.controls.append(card)
-        
-        page.update()
+    # 天気予報の表示処理（日付ごとのカードを使い回し、変わった所だけ更新）
+    display_forecasts = forecast_view.display
+
+    # 実行中の予報取得タスク（別の地域が選ばれたら取り消す）
+    active_fetch = {"task": None}
+
+    show_forecast_message = forecast_view.show_message
+
+    async def fetch_forecast_async(region_code):
+        """天気予報を取得（非同期版）
+
+        キャッシュがあればすぐに表示する。新しい予報がなければ保存済みの
+        古い予報を経過時間つきで先に表示し、裏での取得が終わったら差し替える。
+        保存済みの予報もなければ取得・解析・保存を段階ごとの制限時間つきで行う。
+        途中で別の地域が選ばれたら中断する。
+        """
+        current = asyncio.current_task()
+        previous, active_fetch["task"] = active_fetch["task"], current
+        if previous is not None and not previous.done():
+            previous.cancel()
 
-    def fetch_forecast(region_code):
-        """天気予報を取得（DB対応版）"""
         if not region_code:
-            forecast_result.controls.clear()
-            forecast_result.controls.append(
-                ft.Text("地域を選択してください", color=ft.colors.RED)
-            )
-            page.update()
+            show_forecast_message("地域を選択してください", ft.colors.RED)
             return
 
         try:
-            # まずDBから最新の予報を確認
-            cached_forecasts = get_latest_forecast_from_db(region_code)
-            
+            # メモリ上のキャッシュがあればすぐに表示
+            cached_forecasts = forecast_cache.get(region_code)
             if cached_forecasts:
-                # キャッシュされた予報を表示
                 display_forecasts(cached_forecasts)
-            else:
-                # APIから新しい予報を取得
-                response = requests.get(FORECAST_URL.format(region_code))
-                response.raise_for_status()
-                forecast_data = response.json()
-
-                time_series = forecast_data[0]["timeSeries"][0]
-                area = time_series["areas"][0]
-                dates = time_series["timeDefines"]
-                weathers = area["weathers"]
-
-                # 予報データをDBに保存
-                forecasts = list(zip(dates, weathers))
-                save_forecast_to_db(region_code, forecasts)
-                
-                # 予報を表示
+                return
+
+            show_forecast_message("天気予報を取得しています...", ft.colors.BLUE)
+
+            # DB確認・取得・保存は全セッションで共有する
+            forecasts, reported_at = await load_forecast_stale_while_revalidate(region_code)
+            if reported_at is None:
                 display_forecasts(forecasts)
+                return
+
+            # 古い予報を先に表示し、裏での取得が終わったら差し替える
+            age = format_age(reported_at)
+            display_forecasts(forecasts, f"{age}に発表された予報です（更新中...）")
+            try:
+                forecasts = await load_forecast_shared(region_code)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                ERRORS.inc("revalidate")
+                print(f"天気予報更新エラー({region_code}): {ex}")
+                display_forecasts(forecasts, f"{age}に発表された予報です（更新できませんでした）")
+                return
+            display_forecasts(forecasts)
 
+        except asyncio.CancelledError:
+            # 別の地域が選ばれたので、この地域の結果は表示せずに終える
+            return
+        except asyncio.TimeoutError:
+            ERRORS.inc("fetch_timeout")
+            show_forecast_message("天気予報の取得がタイムアウトしました", ft.colors.RED)
         except Exception as ex:
-            forecast_result.controls.clear()
-            forecast_result.controls.append(
-                ft.Text(f"天気予報取得エラー: {ex}", color=ft.colors.RED)
-            )
-            page.update()
+            ERRORS.inc("fetch")
+            show_forecast_message(f"天気予報取得エラー: {ex}", ft.colors.RED)
+        finally:
+            if active_fetch["task"] is current:
+                active_fetch["task"] = None
+
+    def fetch_forecast(region_code):
+        """天気予報を取得（ページのイベントループで非同期に実行）"""
+        page.run_task(fetch_forecast_async, region_code)
 
     def add_to_favorites(e):
         """選択した地域をお気に入りに追加"""
@@ -328,13 +2041,15 @@ def main(page: ft.Page):
             return
             
         try:
-            with weather_db.get_connection() as conn:
+            with get_weather_db().get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     "INSERT OR IGNORE INTO favorite_regions (region_code) VALUES (?)",
                     (region_dropdown.value,)
                 )
             update_favorite_list()
+            # 追加した地域だけを温める（全件の更新は定時発表後の巡回に任せる）
+            page.run_task(warm_forecast, region_dropdown.value)
             page.show_snack_bar(
                 ft.SnackBar(content=ft.Text("お気に入りに追加しました"))
             )
@@ -346,7 +2061,7 @@ def main(page: ft.Page):
     def remove_from_favorites(region_code):
         """お気に入りから地域を削除"""
         try:
-            with weather_db.get_connection() as conn:
+            with get_weather_db().get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     "DELETE FROM favorite_regions WHERE region_code = ?",
@@ -361,12 +2076,42 @@ def main(page: ft.Page):
                 ft.SnackBar(content=ft.Text(f"エラー: {ex}"))
             )
 
+    # 地域コード → 表示中のお気に入り行
+    favorite_tiles = {}
+    # 表示中のお気に入り [(コード, 名前), ...]
+    current_favorites = []
+
+    def render_favorites(favorites):
+        """お気に入り地域の行を表示（既存の行は使い回す）"""
+        controls = []
+        for code, name in favorites:
+            tile = favorite_tiles.get(code)
+            if tile is None:
+                tile = favorite_tiles[code] = ft.ListTile(
+                    leading=ft.Icon(ft.icons.FAVORITE, color=ft.colors.RED),
+                    title=ft.Text(name),
+                    trailing=ft.IconButton(
+                        ft.icons.DELETE,
+                        on_click=lambda e, c=code: remove_from_favorites(c)
+                    ),
+                    on_click=lambda e, c=code: fetch_forecast(c)
+                )
+            elif tile.title.value != name:
+                tile.title.value = name
+            controls.append(tile)
+
+        # お気に入りから外れた地域の行を破棄
+        for code in set(favorite_tiles) - {code for code, _ in favorites}:
+            del favorite_tiles[code]
+
+        if favorite_regions.controls != controls:
+            favorite_regions.controls = controls
+        current_favorites[:] = favorites
+
     def update_favorite_list():
-        """お気に入り地域リストを更新"""
-        favorite_regions.controls.clear()
-        
+        """お気に入り地域リストをDBから更新"""
         try:
-            with weather_db.get_connection() as conn:
+            with get_weather_db().get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     SELECT r.code, r.name 
@@ -375,25 +2120,108 @@ def main(page: ft.Page):
                     ORDER BY r.name
                 """)
                 favorites = cursor.fetchall()
-                
-                for code, name in favorites:
-                    favorite_regions.controls.append(
-                        ft.ListTile(
-                            leading=ft.Icon(ft.icons.FAVORITE, color=ft.colors.RED),
-                            title=ft.Text(name),
-                            trailing=ft.IconButton(
-                                ft.icons.DELETE,
-                                on_click=lambda e, c=code: remove_from_favorites(c)
-                            ),
-                            on_click=lambda e, c=code: fetch_forecast(c)
-                        )
-                    )
+
+            render_favorites(favorites)
+
+            # 次回の起動時はDBを開く前にこの一覧を表示する
+            if favorites != load_favorites_snapshot():
+                save_favorites_snapshot(favorites)
         except Exception as ex:
-            favorite_regions.controls.append(
+            favorite_regions.controls = [
                 ft.Text(f"お気に入りの取得に失敗: {ex}", color=ft.colors.RED)
-            )
+            ]
         
-        page.update()
+        favorite_regions.update()
+
+    def build_comparison_table(favorites, results):
+        """地域 × 日付 の比較表を作成"""
+        dates = sorted({
+            forecast[0] for forecasts in results.values() for forecast in forecasts
+        })
+        rows = []
+        for code, name in favorites:
+            by_date = {forecast[0]: forecast for forecast in results.get(code, [])}
+            cells = [ft.DataCell(ft.Text(name, weight=ft.FontWeight.BOLD))]
+            for date in dates:
+                forecast = by_date.get(date)
+                if forecast is None:
+                    cells.append(ft.DataCell(ft.Text("-")))
+                    continue
+                _, weather, temp_min, temp_max, rainfall, weather_code = forecast
+                icon, color = get_weather_icon(weather, weather_code)
+                cells.append(ft.DataCell(ft.Row([
+                    ft.Icon(icon, color=color, size=20),
+                    ft.Column([
+                        ft.Text(weather, size=12, color=color),
+                        ft.Text(format_forecast_details(temp_min, temp_max, rainfall), size=11),
+                    ], spacing=0, alignment=ft.MainAxisAlignment.CENTER),
+                ], spacing=5)))
+            rows.append(ft.DataRow(cells=cells))
+
+        return ft.Row([
+            ft.DataTable(
+                columns=[ft.DataColumn(ft.Text("地域"))]
+                + [ft.DataColumn(ft.Text(date)) for date in dates],
+                rows=rows,
+                data_row_max_height=60,
+            )
+        ], scroll=ft.ScrollMode.AUTO)
+
+    # 実行中の比較タスク（もう一度押されたら取り消す）
+    active_comparison = {"task": None}
+
+    async def compare_favorites_async():
+        """お気に入り地域の予報をまとめて取得し、比較表を表示
+
+        キャッシュとDBの確認は1回で済ませ、見つからない地域だけを並行して取得する。
+        """
+        current = asyncio.current_task()
+        previous, active_comparison["task"] = active_comparison["task"], current
+        if previous is not None and not previous.done():
+            previous.cancel()
+
+        favorites = list(current_favorites)
+        if not favorites:
+            comparison_result.controls = [
+                ft.Text("お気に入り地域がありません", color=ft.colors.RED)
+            ]
+            comparison_result.update()
+            return
+
+        try:
+            comparison_result.controls = [
+                ft.Text("天気予報を取得しています...", color=ft.colors.BLUE)
+            ]
+            comparison_result.update()
+
+            results, errors = await load_forecasts_batch([code for code, _ in favorites])
+
+            controls = [build_comparison_table(favorites, results)]
+            if errors:
+                names = dict(favorites)
+                controls.append(ft.Text(
+                    "取得できなかった地域: " + "、".join(names[code] for code in errors),
+                    color=ft.colors.RED,
+                ))
+            comparison_result.controls = controls
+        except asyncio.CancelledError:
+            return
+        except asyncio.TimeoutError:
+            comparison_result.controls = [
+                ft.Text("天気予報の取得がタイムアウトしました", color=ft.colors.RED)
+            ]
+        except Exception as ex:
+            comparison_result.controls = [
+                ft.Text(f"天気予報取得エラー: {ex}", color=ft.colors.RED)
+            ]
+        finally:
+            if active_comparison["task"] is current:
+                active_comparison["task"] = None
+        comparison_result.update()
+
+    def compare_favorites(e):
+        """お気に入り地域の比較表を表示（ページのイベントループで非同期に実行）"""
+        page.run_task(compare_favorites_async)
 
     # UIの構築
     def main(page: ft.Page):
@@ -438,6 +2266,10 @@ def main(page: ft.Page):
         ),
 
         # UIの構築
+
+    # 前回のお気に入り一覧を先に表示する
+    render_favorites(load_favorites_snapshot())
+
     page.add(
         ft.Text("天気予報アプリ", size=30, weight=ft.FontWeight.BOLD),
         
@@ -456,6 +2288,8 @@ def main(page: ft.Page):
                             "地域リストを取得",
                             on_click=fetch_regions,
                         ),
+                        search_field,
+                        search_results,
                         region_dropdown,
                         fetch_button,
                     ], spacing=10),
@@ -479,7 +2313,13 @@ def main(page: ft.Page):
                             on_click=add_to_favorites,
                             icon=ft.icons.ADD
                         ),
-                        favorite_regions
+                        favorite_regions,
+                        ft.ElevatedButton(
+                            "お気に入りの天気を比較",
+                            on_click=compare_favorites,
+                            icon=ft.icons.COMPARE_ARROWS
+                        ),
+                        comparison_result
                     ]),
                     padding=10
                 )
@@ -503,9 +2343,68 @@ def main(page: ft.Page):
         )
     )
 
-    # 初期化時にお気に入りリストを更新
+    report_first_paint(main_started)
+
+    # セッションが閉じたら接続中の数から外す
+    def handle_close(e):
+        ACTIVE_SESSIONS.dec()
+
+    page.on_close = handle_close
+
+    # 初回描画の後でバックグラウンド処理を開始（DBは各処理が最初に使うときに開く）
+    metrics.start_http_server()
+    favorite_refresher.start()
+    retention_scheduler.start()
+
+    # 最初の入力までに地域検索インデックスを用意しておく
+    threading.Thread(target=get_region_search_index, daemon=True).start()
+
+    # 初期化時にお気に入りリストを更新（スナップショットとの差分だけ反映）
     update_favorite_list()
 
 # アプリケーションの起動
 if __name__ == "__main__":
-    ft.app(target=main)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="天気予報アプリ")
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="UIを起動せずに全予報区の天気予報を取得してDBに保存",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="UIを起動せずに古い天気予報をアーカイブへ移して削除",
+    )
+    parser.add_argument(
+        "--analytics",
+        action="store_true",
+        help="UIを起動せずに予報履歴を集計し、地域ごとの統計を表示",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PREFETCH_MAX_WORKERS,
+        help="一括取得時の最大同時リクエスト数",
+    )
+    args, _ = parser.parse_known_args()
+
+    if args.compact:
+        removed = get_weather_db().clear_old_forecasts()
+        print(f"{removed}件の古い天気予報を整理しました")
+    elif args.analytics:
+        # NumPy は集計するときだけ読み込む
+        import analytics
+
+        conn = get_weather_db().get_connection()
+        processed = analytics.update_aggregates(conn)
+        print(f"{processed}件の予報履歴を集計しました")
+        analytics.print_region_statistics(analytics.region_statistics(conn))
+    elif args.prefetch:
+        get_weather_db()
+        start = datetime.now()
+        results, errors = prefetch_all_forecasts(max_workers=args.workers)
+        forecast_writer.flush()
+        elapsed = (datetime.now() - start).total_seconds()
+        print(f"{len(results)}地域の天気予報を保存しました（失敗: {len(errors)}件, {elapsed:.2f}秒）")
+    else:
+        ft.app(target=main)
\ No newline at end of file